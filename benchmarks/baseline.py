@@ -0,0 +1,69 @@
+"""
+Machine-readable benchmark results, saved as baselines under benchmarks/baselines/ and compared against later
+runs so regressions are visible.
+"""
+import json
+import os
+import platform
+import sys
+
+from datetime import datetime, timezone
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+
+def result(value: float, unit: str, better: str = "lower") -> dict:
+    """
+    :param value: the measurement
+    :param unit: its unit, e.g. "ns/op" or "events/s"
+    :param better: "lower" or "higher", whichever direction is an improvement
+    """
+    return {"value": value, "unit": unit, "better": better}
+
+
+def write_results(name: str, results: dict[str, dict], path: str = None) -> str:
+    """
+    Write a set of results, with enough context to know what they were measured on.
+    :return: the path written
+    """
+    path = path or os.path.join(BASELINE_DIR, f"{name}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "benchmark": name,
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "results": results,
+        }, f, indent=2)
+        f.write("\n")
+    return path
+
+
+def compare_results(name: str, results: dict[str, dict], threshold: float, path: str = None) -> bool:
+    """
+    Print each result next to its baseline, flagging changes for the worse beyond the threshold.
+    :param threshold: the fraction a result may get worse by before it counts as a regression, e.g. 0.1
+    :return: True if nothing regressed
+    """
+    path = path or os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    ok = True
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous or not previous["value"]:
+            print(f"{key:40} {current['value']:14.2f} {current['unit']:10} (no baseline)")
+            continue
+        change = (current["value"] - previous["value"]) / previous["value"]
+        worse = change > threshold if current["better"] == "lower" else change < -threshold
+        ok = ok and not worse
+        print(f"{key:40} {current['value']:14.2f} {current['unit']:10} {change:+8.1%}"
+              f"{'  REGRESSION' if worse else ''}")
+    return ok
+
+
+def print_results(results: dict[str, dict]) -> None:
+    for key, current in results.items():
+        print(f"{key:40} {current['value']:14.2f} {current['unit']}")
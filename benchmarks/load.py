@@ -0,0 +1,212 @@
+"""
+End-to-end load test for /api/events/: replays a recording from a local stand-in for the event stream, starts the
+API against it, and opens hundreds to thousands of concurrent SSE clients with mixed filters.
+
+Reports sustained events/s, p50/p99 delivery latency, API CPU time per upstream event and API memory per connected
+subscriber. Process measurements read /proc, so this runs on Linux. Run from the repository root, after building
+the web app:
+
+    python -m benchmarks.load recording.jsonl.gz --clients 1000 --speed 10
+    python -m benchmarks.load recording.jsonl.gz --clients 1000 --speed 10 --save-baseline
+    python -m benchmarks.load recording.jsonl.gz --clients 1000 --speed 10 --compare
+"""
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+from httpx import AsyncClient, Limits, Timeout
+
+from benchmarks.baseline import compare_results, print_results, result, write_results
+
+TIMESTAMP_PATTERN = re.compile(r'"timestamp":\s*([0-9.]+)')
+METRIC_PATTERN = re.compile(r'^l2wc_events_refined_total (\d+)$', re.MULTILINE)
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def process_cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS # utime, stime
+
+
+def process_rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class LoadStats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.latencies: list[float] = []
+        self.measuring = False
+
+
+async def run_client(client: AsyncClient, url: str, stats: LoadStats) -> None:
+    """
+    One SSE subscriber: count delivered events and, while measuring, their latency from the restamped timestamp.
+    """
+    connected = False
+    try:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            stats.connected += 1
+            connected = True
+            async for line in response.aiter_lines():
+                if not stats.measuring or not line.startswith("data:"):
+                    continue
+                now = time.time()
+                for timestamp in TIMESTAMP_PATTERN.findall(line):
+                    stats.delivered += 1
+                    stats.latencies.append(now - float(timestamp))
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        if connected:
+            stats.dropped += 1
+        else:
+            stats.failed += 1
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def events_refined(client: AsyncClient, api_url: str) -> int:
+    response = await client.get(f"{api_url}/api/metrics")
+    return int(METRIC_PATTERN.search(response.text).group(1))
+
+
+async def wait_until_up(client: AsyncClient, url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} didn't come up")
+        await asyncio.sleep(0.25)
+
+
+async def run(args) -> dict[str, dict]:
+    replay_url = f"http://127.0.0.1:{args.replay_port}/v2/stream/recentchange"
+    wiki_list_url = f"http://127.0.0.1:{args.replay_port}/wikimedias_csv.php"
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    replay_process = subprocess.Popen(
+        [sys.executable, "-m", "l2wc_api.replay", "serve", args.recording, "--speed", args.speed, "--loop",
+         "--restamp", "--port", str(args.replay_port)], stdout=subprocess.DEVNULL)
+    api_process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "l2wc_api.main:app", "--port", str(args.api_port), "--log-level", "warning"],
+        env={**os.environ, "L2WC_EVENT_STREAM_URL": replay_url, "L2WC_WIKI_LIST_URL": wiki_list_url},
+        stdout=subprocess.DEVNULL)
+
+    stats = LoadStats()
+    clients = []
+    limits = Limits(max_connections=args.clients + 10, max_keepalive_connections=10)
+    try:
+        async with AsyncClient(timeout=Timeout(30, read=None), limits=limits) as client:
+            try:
+                await wait_until_up(client, f"{api_url}/api/health_check")
+                codes = [wiki['wikiCode'] for wiki in (await client.get(f"{api_url}/api/wiki_codes")).json()]
+                languages = [language['langCode'] for language in (await client.get(f"{api_url}/api/languages")).json()]
+                types = [wiki_type['wikiType'] for wiki_type in (await client.get(f"{api_url}/api/types")).json()]
+
+                # one subscriber first, so the memory baseline includes a connected event stream
+                urls = [f"{api_url}/api/events/?types=wikipedia"]
+                for i in range(1, args.clients):
+                    kind = i % 10
+                    if kind < 5:
+                        urls.append(f"{api_url}/api/events/?codes={codes[i % len(codes)]}")
+                    elif kind < 8:
+                        urls.append(f"{api_url}/api/events/?languages={languages[i % len(languages)]}")
+                    else:
+                        urls.append(f"{api_url}/api/events/?types={types[i % len(types)]}")
+
+                clients.append(asyncio.create_task(run_client(client, urls[0], stats)))
+                await asyncio.sleep(args.warmup)
+                base_rss = process_rss_bytes(api_process.pid)
+
+                # connect in batches, so the listen backlog doesn't overflow and reset connections
+                for batch_start in range(1, args.clients, args.ramp):
+                    for url in urls[batch_start:batch_start + args.ramp]:
+                        clients.append(asyncio.create_task(run_client(client, url, stats)))
+                    while stats.connected + stats.failed < len(clients):
+                        await asyncio.sleep(0.05)
+                await asyncio.sleep(args.warmup)
+                loaded_rss = process_rss_bytes(api_process.pid)
+
+                refined_before = await events_refined(client, api_url)
+                cpu_before = process_cpu_seconds(api_process.pid)
+                stats.measuring = True
+                started = time.monotonic()
+                await asyncio.sleep(args.duration)
+                stats.measuring = False
+                elapsed = time.monotonic() - started
+                cpu_used = process_cpu_seconds(api_process.pid) - cpu_before
+                refined = await events_refined(client, api_url) - refined_before
+            finally:
+                for task in clients:
+                    task.cancel()
+                await asyncio.gather(*clients, return_exceptions=True)
+    finally:
+        for process in (api_process, replay_process):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill() # still waiting on streaming connections to finish
+
+    if stats.failed or stats.dropped:
+        print(f"{stats.failed} of {args.clients} clients failed to connect, {stats.dropped} were disconnected")
+    return {
+        "upstream_events_per_second": result(refined / elapsed, "events/s", "higher"),
+        "deliveries_per_second": result(stats.delivered / elapsed, "events/s", "higher"),
+        "delivery_latency_p50_ms": result(percentile(stats.latencies, 0.5) * 1000, "ms"),
+        "delivery_latency_p99_ms": result(percentile(stats.latencies, 0.99) * 1000, "ms"),
+        "cpu_per_upstream_event_us": result(cpu_used / max(refined, 1) * 1e6, "us/event"),
+        "rss_per_subscriber_kb": result((loaded_rss - base_rss) / max(args.clients - 1, 1) / 1024, "KiB"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("recording", help="recording made with python -m l2wc_api.replay record")
+    parser.add_argument("--clients", type=int, default=500, help="concurrent SSE clients")
+    parser.add_argument("--speed", default="10", help="replay speed, a multiple of the recorded rate, or max")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure for")
+    parser.add_argument("--ramp", type=int, default=50, help="clients to connect at a time")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds to settle before measuring")
+    parser.add_argument("--replay-port", type=int, default=8101)
+    parser.add_argument("--api-port", type=int, default=8100)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="change for the worse that counts as a regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    ok = True
+    if args.compare:
+        ok = compare_results("load", results, args.threshold)
+    else:
+        print_results(results)
+    if args.save_baseline:
+        print(f"Saved baseline to {write_results('load', results)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
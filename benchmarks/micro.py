@@ -0,0 +1,176 @@
+"""
+Microbenchmarks for the relay hot path, run on the events of a recording made with l2wc_api.replay.
+
+Run from the repository root, after building the web app:
+
+    python -m benchmarks.micro recording.jsonl.gz
+    python -m benchmarks.micro recording.jsonl.gz --save-baseline
+    python -m benchmarks.micro recording.jsonl.gz --compare
+"""
+import argparse
+import logging
+import sys
+import time
+
+from typing import Callable
+
+from benchmarks.baseline import compare_results, print_results, result, write_results
+from l2wc_api import main as relay
+from l2wc_api.replay import read_recording
+
+SUBSCRIBER_COUNT = 1000
+
+
+def time_per_item(fn: Callable[[], int], repeat: int) -> float:
+    """
+    Run a benchmark function several times and keep the fastest run.
+    :param fn: runs the benchmark once and returns how many items it processed
+    :return: nanoseconds per item
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        count = fn()
+        best = min(best, (time.perf_counter_ns() - started) / max(count, 1))
+    return best
+
+
+def mixed_filters(i: int) -> tuple[list[str], list[str], list[str]]:
+    """
+    A spread of subscriber filters like the ones browsers send: mostly single wikis and languages, some wiki types.
+    """
+    codes = list(relay.wiki_dict)
+    languages = [language['enName'] for language in relay.language_dict.values()]
+    types = list(relay.wiki_types)
+    kind = i % 10
+    if kind < 5:
+        return [codes[i % len(codes)]], [], []
+    if kind < 8:
+        return [], [], [languages[i % len(languages)]]
+    return [], [types[i % len(types)]], []
+
+
+def run(recording: str, repeat: int) -> dict[str, dict]:
+    relay.load_wikis_list()
+    raw_data = [event.data for event in read_recording(recording)]
+    raw_events = []
+    for data in raw_data:
+        try:
+            raw_event = relay.json_loads(data)
+            if relay.accept_raw_event(raw_event):
+                raw_events.append(raw_event)
+        except Exception:
+            pass
+    refined_events = [relay.refine_event(raw_event) for raw_event in raw_events]
+    relayed_events = [relay.RelayedEvent(seq, event, data, relay.encode_event_frame(seq, data))
+                      for seq, event, data in ((seq, event, relay.encode_event_data(event))
+                                               for seq, event in enumerate(refined_events))]
+    print(f"{len(raw_data)} recorded events, {len(raw_events)} accepted")
+
+    def prefilter():
+        for data in raw_data:
+            relay.prefilter_raw_event(data)
+        return len(raw_data)
+
+    def parse_and_accept():
+        for data in raw_data:
+            try:
+                relay.accept_raw_event(relay.json_loads(data))
+            except Exception:
+                pass
+        return len(raw_data)
+
+    def parse():
+        for data in raw_data:
+            relay.parse_raw_event(data)
+        return len(raw_data)
+
+    def refine():
+        for raw_event in raw_events:
+            relay.refine_event(raw_event)
+        return len(raw_events)
+
+    def encode():
+        for refined_event in refined_events:
+            relay.encode_event_frame(0, relay.encode_event_data(refined_event))
+        return len(refined_events)
+
+    codes, types, languages = {'en_wikipedia', 'commons'}, {'wiktionary'}, {'Japanese', 'German'}
+
+    def filter_pass():
+        for refined_event in refined_events:
+            relay.filter_pass(refined_event, codes, types, languages)
+        return len(refined_events)
+
+    registry = relay.SubscriptionRegistry()
+    for i in range(SUBSCRIBER_COUNT):
+        registry.subscribe(relay.Subscriber(), *mixed_filters(i))
+
+    def fan_out():
+        for relayed_event in relayed_events:
+            registry.publish(relayed_event)
+        return len(relayed_events)
+
+    group = relay.SubscriptionGroup((frozenset(), frozenset(), frozenset(), frozenset()))
+    subscriber = relay.Subscriber()
+    subscriber.join(group)
+
+    def subscriber_ring():
+        for relayed_event in relayed_events:
+            group.append(relayed_event)
+            subscriber.read()
+        return len(relayed_events)
+
+    rate_counters = relay.RateCounters()
+
+    def count_rates():
+        now = time.monotonic()
+        for refined_event in refined_events:
+            rate_counters.count(refined_event, now)
+        return len(refined_events)
+
+    def load_wikis_list():
+        relay.load_wikis_list()
+        return 1
+
+    results = {
+        "prefilter_raw_event": result(time_per_item(prefilter, repeat), "ns/event"),
+        "parse_and_accept_raw_event": result(time_per_item(parse_and_accept, repeat), "ns/event"),
+        "parse_raw_event": result(time_per_item(parse, repeat), "ns/event"),
+        "refine_event": result(time_per_item(refine, repeat), "ns/event"),
+        "encode_event_frame": result(time_per_item(encode, repeat), "ns/event"),
+        "filter_pass": result(time_per_item(filter_pass, repeat), "ns/event"),
+        f"fan_out_{SUBSCRIBER_COUNT}_subscribers": result(time_per_item(fan_out, repeat), "ns/event"),
+        "subscriber_ring_append_read": result(time_per_item(subscriber_ring, repeat), "ns/event"),
+        "rate_counters_count": result(time_per_item(count_rates, repeat), "ns/event"),
+        "load_wikis_list": result(time_per_item(load_wikis_list, max(1, repeat // 2)) / 1e6, "ms"),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.micro", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("recording", help="recording made with python -m l2wc_api.replay record")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark; the fastest is kept")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    # The API's logger isn't made with logging.getLogger, so a new level wouldn't clear the levels it has cached as
+    # enabled since importing. Leave its messages out at its handler instead, before they are queued and printed.
+    for handler in relay.logger.handlers:
+        handler.setLevel(logging.ERROR)
+    results = run(args.recording, args.repeat)
+    ok = True
+    if args.compare:
+        ok = compare_results("micro", results, args.threshold)
+    else:
+        print_results(results)
+    if args.save_baseline:
+        print(f"Saved baseline to {write_results('micro', results)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,125 @@
 import asyncio
+import atexit
+import bisect
+import copy
+import gzip
+import hashlib
 import html
+import itertools
 import json
+import multiprocessing
+import os
+import random
+import re
 import sys
+import time
+import zlib
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from json.encoder import encode_basestring_ascii
 from contextlib import asynccontextmanager
-from logging import Logger, StreamHandler, Formatter
-from typing import Any, AsyncGenerator, Optional, Set
+from contextvars import ContextVar
+from logging import DEBUG, ERROR, INFO, Logger, StreamHandler, Formatter
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, AsyncGenerator, Callable, FrozenSet, Iterable, NamedTuple, Optional, Tuple
 from uuid import uuid4
 
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Header, Query, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, RedirectResponse
+from fastapi.responses import Response, StreamingResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from httpx import AsyncClient
 from httpx_sse import aconnect_sse
 
-WIKI_LIST_URL = "https://wikistats.wmcloud.org/wikimedias_csv.php"
-WIKI_EVENT_STREAM_URL = "https://stream.wikimedia.org/v2/stream/recentchange"
+try:
+    # orjson is an optional speedup for decoding the firehose and encoding refined events; fall back to the
+    # standard library without it
+    from orjson import loads as json_loads, dumps as orjson_dumps
+except ImportError:
+    json_loads = json.loads
+    orjson_dumps = None
+
+try:
+    # msgpack is optional too; without it the binary wire format isn't offered
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    # brotli is optional as well; event streams are gzip compressed for clients that accept it without it
+    import brotli
+except ImportError:
+    brotli = None
+
+# set L2WC_WIKI_LIST_URL to refresh from a local stand-in instead, such as the one l2wc_api/replay.py serves
+WIKI_LIST_URL = os.environ.get('L2WC_WIKI_LIST_URL', "https://wikistats.wmcloud.org/wikimedias_csv.php")
+WIKI_LIST_FILE = "wikimedias.csv"  # local copy, loaded at startup and kept if refreshing fails
+# seconds between refreshes of the wiki list from WIKI_LIST_URL, or 0 to only use the local copy
+WIKI_LIST_REFRESH_INTERVAL = float(os.environ.get('L2WC_WIKI_LIST_REFRESH_SECONDS', '86400'))
+WIKI_LIST_FETCH_TIMEOUT = 30  # seconds
+WIKI_LIST_MIN_FRACTION = 0.9  # a refreshed list indexing fewer wikis than this share of the current one is rejected
+# set L2WC_EVENT_STREAM_URL to replay a recording instead, see l2wc_api/replay.py
+WIKI_EVENT_STREAM_URL = os.environ.get('L2WC_EVENT_STREAM_URL', "https://stream.wikimedia.org/v2/stream/recentchange")
 CLIENT_HEADERS = {'User-Agent': 'listen-to-wiki-changes/0.0 (https://listen-to-wiki-changes.toolforge.org/; ttaylor@wikimedia.org)'}
-EVENT_QUEUE_SIZE = 100
+EVENT_RING_SIZE = 128  # events each subscription group holds for its subscribers to catch up on
+REPLAY_BUFFER_SIZE = 5000  # most recent events kept for clients resuming with Last-Event-ID
+REPLAY_BUFFER_SECONDS = 300  # and never older than this
+EVENT_BATCH_MIN_MS = 50  # bounds for the batch_ms window clients can ask for on /api/events/
+EVENT_BATCH_MAX_MS = 1000
+EVENT_RATE_MIN = 0.1  # bounds for the max_rate clients can ask for, in events per second
+EVENT_RATE_MAX = 1000
+PRIORITY_EVENT_TYPES = frozenset(('new_page', 'new_user'))  # kept ahead of edits when a max_rate is exceeded
+RATE_WINDOW_SECONDS = 60  # sliding window for the per wiki, type and language event rates at /api/rates
+RATE_BUCKET_SECONDS = 1  # resolution of the window
+RATE_BUCKETS = RATE_WINDOW_SECONDS // RATE_BUCKET_SECONDS
+RATE_STREAM_MIN_INTERVAL = 5  # seconds; bounds for the interval clients can ask for on /api/rates/stream
+RATE_STREAM_MAX_INTERVAL = 60
+RATES_CACHE_CONTROL = f"public, max-age={RATE_BUCKET_SECONDS}"
+KEEP_ALIVE_FRAME = b": keep-alive\n\n"
+KEEP_ALIVE_INTERVAL = 15  # seconds without events before a keep-alive is sent
+STALLED_STREAM_TIMEOUT = 60  # seconds an event stream's writes may not complete for before its connection is dropped
+MSGPACK_KEEP_ALIVE = b"\xc0"  # a MessagePack nil, which binary stream clients skip
+WIRE_FORMATS = ('json', 'compact', 'msgpack')
+# Event streams are compressed with one compressor per connection, flushed after every frame. Small windows and
+# moderate levels keep the memory and CPU cost per connection down, since connections last hours.
+STREAM_COMPRESSION_GZIP_LEVEL = 5
+STREAM_COMPRESSION_GZIP_WBITS = 16 + 13  # gzip container, 8 KiB window
+STREAM_COMPRESSION_GZIP_MEMLEVEL = 6
+STREAM_COMPRESSION_BROTLI_QUALITY = 4
+STREAM_COMPRESSION_BROTLI_LGWIN = 16
+# past this many compressed event streams, new ones are sent uncompressed to bound the CPU spent on compression
+STREAM_COMPRESSION_MAX_STREAMS = int(os.environ.get('L2WC_COMPRESSED_STREAMS_MAX', '2000'))
+METADATA_CACHE_CONTROL = "public, max-age=300"  # the wiki list changes rarely, and conditional requests are cheap
+# Metadata responses are compressed again every time the wiki list is refreshed. Top levels would save a few more
+# KiB on the wiki list, at fifty times the CPU (about 300 ms for brotli's highest quality).
+METADATA_COMPRESSION_GZIP_LEVEL = 6
+METADATA_COMPRESSION_BROTLI_QUALITY = 5
+# "standalone" connects to the wiki event stream itself; "worker" receives refined events from an ingest process
+RELAY_MODE = os.environ.get('L2WC_RELAY_MODE', 'standalone')
+RELAY_SOCKET_PATH = os.environ.get('L2WC_RELAY_SOCKET', '/tmp/listen-to-wiki-changes-relay.sock')
+RELAY_WORKER_BUFFER_LIMIT = 1024 * 1024  # bytes of unsent events a slow worker may lag behind before we drop
+INGEST_METRICS_INTERVAL = 5  # seconds between the event stream metrics the ingest process sends its workers
+STREAM_CHECKPOINT_PATH = os.environ.get('L2WC_CHECKPOINT_FILE', '.relay_checkpoint.json')
+STREAM_CHECKPOINT_INTERVAL = 5  # seconds between writes of the upstream checkpoint file
+STREAM_RESUME_MAX_AGE = 300  # seconds; resuming from an older checkpoint would flood clients with stale events
+PARSE_WORKERS = int(os.environ.get('L2WC_PARSE_WORKERS', '0'))  # processes to parse and refine bursts on; 0 for none
+PARSE_OFFLOAD_RATE = float(os.environ.get('L2WC_PARSE_OFFLOAD_RATE', '200'))  # upstream events/s to offload above
+PARSE_OFFLOAD_LOOP_LAG = 0.05  # seconds the event loop may fall behind its timers before parsing is offloaded
+PARSE_BATCH_SIZE = 64  # upstream events handed to a parse worker at once
+PARSE_BATCH_MAX_DELAY = 0.02  # seconds an event may wait for its batch to fill
+PARSE_BATCHES_IN_FLIGHT = 2  # per worker; reading from upstream waits when this many batches are being parsed
+RECENT_EVENT_IDS_SIZE = 10000  # upstream event ids remembered to drop events redelivered after resuming
+RECENT_EVENT_IDS_SAVED = 1000  # of those, the newest saved with the checkpoint, for after a restart
+RECONNECT_BACKOFF_BASE = 1  # seconds
+RECONNECT_BACKOFF_MAX = 60  # seconds
+RECONNECT_HEALTHY_SECONDS = 60  # a connection that lasted this long before dropping resets the backoff
+RELAY_SHUTDOWN_TIMEOUT = 5  # seconds to wait for the relay loop to finish when shutting down
+LOG_LEVEL = os.environ.get('L2WC_LOG_LEVEL', 'INFO').upper()
+LOG_SUMMARY_INTERVAL = 60  # seconds; sampled messages left out of the log are summarized this often
+LOG_SAMPLE_LIMIT = 5  # messages of each sampled kind logged per interval before the rest are only counted
 KNOWN_EVENT_SCHEMA = "/mediawiki/recentchange/1.0.0" # we will watch for this in case it changes
 # The schema is documented at this URL:
 # https://gitlab.wikimedia.org/repos/data-engineering/schemas-event-primary/-/blob/master/jsonschema/mediawiki/recentchange/current.yaml?ref_type=heads
@@ -44,24 +145,114 @@ SPECIAL_WIKIS = {
 }
 
 logger: Logger = Logger(__name__)
-logger.setLevel("DEBUG")
-
-# this stuff ensures our logging gets displayed by the FastAPI app
+try:
+    logger.setLevel(LOG_LEVEL)
+    log_level_error = None
+except ValueError as e:
+    logger.setLevel(INFO) # warned about below, once there is a handler
+    log_level_error = e
+
+# this stuff ensures our logging gets displayed by the FastAPI app. Records are queued and written to stdout by a
+# background thread, so a slow stdout never holds up the event loop.
 stream_handler = StreamHandler(sys.stdout)
 log_formatter = Formatter("%(asctime)s [%(processName)s: %(process)d] [%(threadName)s: %(thread)d] [%(levelname)s] %(name)s: %(message)s")
 stream_handler.setFormatter(log_formatter)
-logger.addHandler(stream_handler)
+log_queue = SimpleQueue()
+log_listener = QueueListener(log_queue, stream_handler)
+log_listener.start()
+atexit.register(log_listener.stop)  # writes out what is still queued
+logger.addHandler(QueueHandler(log_queue))
 
 logger.info('API is starting up')
+if log_level_error:
+    logger.warning(f"Logging at INFO instead of L2WC_LOG_LEVEL: {log_level_error}")
+
 
+class SampledLog:
+    """
+    A message logged once per connection or per event, which would flood the log during reconnect storms or bursts
+    of bad events. The first few in each interval are logged; the rest are only counted, and summarized in one
+    message when the interval is over. Arguments are %-formatted by the logger, so messages left out cost a counter
+    increment.
+    """
+    __slots__ = ('level', 'summary', 'window_started', 'logged', 'left_out')
+
+    def __init__(self, level: int, summary: str):
+        """
+        :param level: the logging level of the message and its summaries
+        :param summary: the summary message, formatted with the count of messages left out and the seconds they
+                        were left out over
+        """
+        self.level = level
+        self.summary = summary
+        self.window_started = time.monotonic()
+        self.logged = 0
+        self.left_out = 0
+        sampled_logs.append(self)
+
+    def log(self, message: str, *args, exc_info: bool = False) -> None:
+        if not logger.isEnabledFor(self.level):
+            return
+        if self.logged >= LOG_SAMPLE_LIMIT:
+            now = time.monotonic()
+            if now - self.window_started < LOG_SUMMARY_INTERVAL:
+                self.left_out += 1
+                relay_metrics.log_messages_sampled += 1
+                return
+            self.flush(now)
+        self.logged += 1
+        logger.log(self.level, message, *args, exc_info=exc_info)
+
+    def flush(self, now: float) -> None:
+        """
+        Log the summary of the messages left out, if any, and start a new interval.
+        """
+        if self.left_out:
+            logger.log(self.level, self.summary, self.left_out, now - self.window_started)
+        self.window_started = now
+        self.logged = 0
+        self.left_out = 0
+
+
+sampled_logs: list[SampledLog] = []
+client_connected_log = SampledLog(INFO, "%d more clients connected in the last %.0fs")
+client_disconnected_log = SampledLog(INFO, "%d more clients disconnected in the last %.0fs")
+stream_request_log = SampledLog(DEBUG, "%d more event stream requests in the last %.0fs")
+stream_replay_log = SampledLog(DEBUG, "%d more event streams replayed missed events in the last %.0fs")
+subscriber_dropped_log = SampledLog(DEBUG, "%d more subscribers fell behind in the last %.0fs")
+stream_reaped_log = SampledLog(INFO, "%d more stalled event streams dropped in the last %.0fs")
+event_error_log = SampledLog(ERROR, "%d more events failed to process in the last %.0fs")
+
+
+def flush_sampled_logs() -> None:
+    now = time.monotonic()
+    for sampled_log in sampled_logs:
+        sampled_log.flush(now)
+
+
+async def sampled_log_summary_loop():
+    """
+    Background task: summarize sampled messages every interval, rather than only when the next one comes in.
+    """
+    while True:
+        await asyncio.sleep(LOG_SUMMARY_INTERVAL)
+        flush_sampled_logs()
+
+
+# The wiki list indexes. Each load builds a complete new set and swaps it in with install_wiki_index, so they are
+# never modified once installed, and readers never see a half-built index.
 wiki_list_columns: list[str] = [] # the column names from the wikistats wiki list file, in order.
 wiki_types: dict[ str, dict[str, str]] = {} # a list of all the wiki types
 wiki_list: list[dict] = [] # all the wiki metadata dicts
 wiki_dict: dict[str, dict] = {} # lang code -> wiki metadata dict
 language_dict: dict[str, dict[str, Any]] = {} # lang code -> { lang_code: language code, en_name: English language name, local_name: local language name}
 wiki_host_index: dict[str, str] = {} # server name -> wiki code
+domain_enrichment: dict[str, "DomainEnrichment"] = {} # server name -> code, type and language for refined events
 
 event_relay_loop_task = None
+wiki_list_refresh_task = None
+heartbeat_task = None
+log_summary_task = None
 
 # Connection state management for conditional connection to event stream
 stream_active = False
@@ -80,32 +271,72 @@ async def fastapi_lifespan(fastapi_app: FastAPI):
     logger.info("Starting up...")
     load_wikis_list()
 
-    logger.debug("Starting SSE event relay loop task...")
-    global event_relay_loop_task
-    event_relay_loop_task = asyncio.create_task(edit_event_relay_loop())
+    global event_relay_loop_task, wiki_list_refresh_task, heartbeat_task, log_summary_task
+    heartbeat_task = asyncio.create_task(heartbeat_scheduler.run())
+    log_summary_task = asyncio.create_task(sampled_log_summary_loop())
+    if WIKI_LIST_REFRESH_INTERVAL:
+        wiki_list_refresh_task = asyncio.create_task(refresh_wikis_list_loop())
+    if RELAY_MODE == 'worker':
+        logger.debug(f"Starting ingest subscriber loop task on {RELAY_SOCKET_PATH}...")
+        event_relay_loop_task = asyncio.create_task(ingest_subscriber_loop())
+    else:
+        logger.debug("Starting SSE event relay loop task...")
+        event_relay_loop_task = asyncio.create_task(edit_event_relay_loop())
 
     #let the application run
     logger.info("Startup complete.")
     yield
 
     # Application shutdown activities
-    global active_subscribers
-    for queue in list(active_subscribers):
-        active_subscribers.remove(queue)
+    subscription_registry.clear()
+    replay_buffer.clear()
+    if wiki_list_refresh_task:
+        wiki_list_refresh_task.cancel()
+    if heartbeat_task:
+        heartbeat_task.cancel()
+    if log_summary_task:
+        log_summary_task.cancel()
+        flush_sampled_logs()
     if event_relay_loop_task:
         logger.debug("Shutting down SSE event relay loop task...")
         event_relay_loop_task.cancel()
-        try:
-            await event_relay_loop_task
-        except asyncio.CancelledError:
+        done, _ = await asyncio.wait((event_relay_loop_task,), timeout=RELAY_SHUTDOWN_TIMEOUT)
+        if done:
             logger.info("Event relay task cleanly shutdown.")
+        else:
+            logger.warning(f"Event relay task didn't shut down within {RELAY_SHUTDOWN_TIMEOUT}s, leaving it behind")
 
     pass
 
 
-app = FastAPI(title="listen-to-wiki-changes", lifespan=fastapi_lifespan)
+# the send callable the server passed for the HTTP request being handled, before any middleware wrapped it
+server_send: ContextVar[Optional[Callable]] = ContextVar('server_send', default=None)
 
-app.mount("/app", StaticFiles(directory="web_app/dist", html=True), name="static")
+
+class RelayApp(FastAPI):
+    """
+    The FastAPI app, noting the send callable the server passes each HTTP request, so the connection of an event
+    stream can be aborted if its client stops reading. See request_transport.
+    """
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] == 'http':
+            server_send.set(send)
+        await super().__call__(scope, receive, send)
+
+
+def request_transport() -> Optional[asyncio.Transport]:
+    """
+    :return: the connection the current HTTP request came in on, or None if the server doesn't make it reachable.
+             Uvicorn's send is a method of the object handling the request, which holds the connection's transport.
+    """
+    transport = getattr(getattr(server_send.get(), '__self__', None), 'transport', None)
+    return transport if isinstance(transport, asyncio.Transport) else None
+
+
+app = RelayApp(title="listen-to-wiki-changes", lifespan=fastapi_lifespan)
+
+# the built web app is looked for on the first request rather than now, so the API and its tests run without it
+app.mount("/app", StaticFiles(directory="web_app/dist", html=True, check_dir=False), name="static")
 
 allowed_origins = ["*"]
 
@@ -122,100 +353,189 @@ async def read_root():
     return RedirectResponse("/app")
 
 
+class WikiIndex(NamedTuple):
+    """
+    A complete set of wiki list indexes, built by parse_wikis_list.
+    """
+    wiki_list_columns: list[str]
+    wiki_types: dict[str, dict[str, str]]
+    wiki_list: list[dict]
+    wiki_dict: dict[str, dict]
+    language_dict: dict[str, dict[str, Any]]
+    wiki_host_index: dict[str, str]
+    domain_enrichment: dict[str, "DomainEnrichment"]
+
+
+class PreparedWikiIndex(NamedTuple):
+    """
+    A set of wiki list indexes along with everything derived from them, built by prepare_wiki_index.
+    """
+    index: WikiIndex
+    wire_format_tables: "WireFormatTables"
+    metadata_responses: dict[str, "PreEncodedResponse"]
+
+
+class DomainEnrichment(NamedTuple):
+    """
+    What refine_event adds to the events of one wiki domain, resolved once when the wiki list is loaded.
+    """
+    code: str
+    wiki_type: Optional[str]
+    language: str
+
+
 def load_wikis_list():
     """
-    Load the wiki metadata list from the wikistats wiki list file.
+    Load the wiki metadata list from the local copy of the wikistats wiki list file.
+    """
+    with open(WIKI_LIST_FILE, 'r', encoding='utf-8') as f:
+        install_wiki_index(prepare_wiki_index(parse_wikis_list(f)))
+
+
+def prepare_wiki_index(index: WikiIndex) -> PreparedWikiIndex:
+    """
+    Build what is derived from a new set of wiki list indexes: the wire format tables extended with its values, and
+    the compressed metadata responses. The current tables are only read, never changed, so this is safe to run in a
+    thread.
+    """
+    tables = wire_format_tables.extended(index.wiki_dict, index.wiki_types,
+                                         (wiki.get('language') for wiki in index.wiki_list))
+    return PreparedWikiIndex(index, tables, build_metadata_responses(index, tables))
+
+
+def install_wiki_index(prepared: PreparedWikiIndex):
+    """
+    Swap in a freshly built set of wiki list indexes, along with everything derived from them. Nothing here
+    awaits, so the event loop switches from the old indexes to the new ones in one step.
+    """
+    global wiki_list_columns, wiki_types, wiki_list, wiki_dict, language_dict, wiki_host_index, domain_enrichment
+    global wire_format_tables, metadata_responses
+    wiki_list_columns, wiki_types, wiki_list, wiki_dict, language_dict, wiki_host_index, domain_enrichment = \
+        prepared.index
+    wire_format_tables = prepared.wire_format_tables
+    metadata_responses = prepared.metadata_responses
+    parse_offload.restart_pool() # the parse workers refine with a copy of the domain index
+
+
+async def refresh_wikis_list_loop():
+    """
+    Refresh the wiki list from WIKI_LIST_URL now and then, keeping the current one if that fails. The list is
+    parsed, and the responses derived from it compressed, in a thread, so the relay loop keeps going meanwhile.
+    """
+    async with AsyncClient(headers=CLIENT_HEADERS, timeout=WIKI_LIST_FETCH_TIMEOUT, follow_redirects=True) as client:
+        while True:
+            try:
+                response = await client.get(WIKI_LIST_URL)
+                response.raise_for_status()
+                index = await asyncio.to_thread(parse_wikis_list, response.text.splitlines(keepends=True))
+                if len(index.wiki_dict) < len(wiki_dict) * WIKI_LIST_MIN_FRACTION:
+                    logger.warning(f"Keeping the current wiki list: the one from {WIKI_LIST_URL} indexes only "
+                                   f"{len(index.wiki_dict)} wikis, against {len(wiki_dict)} now")
+                else:
+                    install_wiki_index(await asyncio.to_thread(prepare_wiki_index, index))
+                    logger.info(f"Refreshed the wiki list from {WIKI_LIST_URL}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Unable to refresh the wiki list from {WIKI_LIST_URL}, keeping the current one: {e!r}")
+            await asyncio.sleep(WIKI_LIST_REFRESH_INTERVAL)
+
+
+def parse_wikis_list(lines: Iterable[str]) -> WikiIndex:
+    """
+    Build the wiki list indexes from the lines of a wikistats wiki list file. Only local variables are touched,
+    so this is safe to run in a thread.
+    :param lines: the lines of the CSV file
+    :return: the new indexes
     """
     logger.info("Loading wikis list...")
-    wiki_list.clear()
-    wiki_types.clear()
+    wiki_list: list[dict] = []
+    wiki_types: dict[str, dict[str, str]] = {}
     wiki_types['special'] = { 'wikiType': 'special' } # because they are indeed special
-    wiki_dict.clear()
-    wiki_host_index.clear()
-    language_dict.clear()
-    wiki_list_columns.clear()
+    wiki_dict: dict[str, dict] = {}
+    wiki_host_index: dict[str, str] = {}
+    language_dict: dict[str, dict[str, Any]] = {}
+    wiki_list_columns: list[str] = []
     wiki_count = 0
 
-    # Read from local CSV file instead of web request
-    with open('wikimedias.csv', 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.startswith("rank"):
-                # header row
-                wiki_list_columns.extend(line.split(','))
-            else:
-                # hack to fix HTML encoding in response
-                line = html.unescape(line)
-                wiki_count = wiki_count + 1
-                try:
-                    wiki_metadata = dict(zip(wiki_list_columns, line.split(',')))
-                    wiki_metadata['lang_code'] = 'multi' # until proven otherwise
-
-                    wiki_type = wiki_metadata['type'] if 'type' in wiki_metadata.keys() else None
-                    if wiki_type and not wiki_type.isdigit():
-                        # the list will have an entry for every line in the retrieved data, including things we don't index
-                        wiki_list.append(wiki_metadata)
-                        wiki_type = wiki_metadata['type']
-                        prefix = wiki_metadata['prefix']
-                        if wiki_type == 'special':
-                            prefix_split = prefix.split('.')
-                            special_name = "NOT_SPECIAL"
-                            if prefix in SPECIAL_WIKIS.keys():
-                                special_name = SPECIAL_WIKIS[prefix][0]
-                                wiki_metadata['code'] = special_name
-                                wiki_metadata['display_name'] = SPECIAL_WIKIS[prefix][1]
-                                wiki_dict[special_name] = wiki_metadata
-                                wiki_host_index[prefix] = special_name
-                            elif prefix.startswith('www.') and 'wikimedia' in prefix and len(prefix_split) == 3 and prefix_split[0].strip():
-                                # maybe a language code as a TLD CC
-                                special_name = prefix_split[-1] + "_wikimedia"
-                                wiki_metadata['code'] = special_name
-                                wiki_metadata['display_name'] = special_name.capitalize()
-                                wiki_dict[special_name] = wiki_metadata
-                                wiki_host_index[prefix] = special_name
-                        elif prefix.endswith('.org') and 'wikimedia' in prefix and len(prefix_split) == 3 and prefix_split[0].strip():
-                            # probably a language code as the host name prefix
-                            special_name = prefix_split[0] +  "_wikimedia"
+    for line in lines:
+        if line.startswith("rank"):
+            # header row
+            wiki_list_columns.extend(line.split(','))
+        else:
+            # hack to fix HTML encoding in response
+            line = html.unescape(line)
+            wiki_count = wiki_count + 1
+            try:
+                wiki_metadata = dict(zip(wiki_list_columns, line.split(',')))
+                wiki_metadata['lang_code'] = 'multi' # until proven otherwise
+
+                wiki_type = wiki_metadata['type'] if 'type' in wiki_metadata.keys() else None
+                if wiki_type and not wiki_type.isdigit():
+                    # the list will have an entry for every line in the retrieved data, including things we don't index
+                    wiki_list.append(wiki_metadata)
+                    wiki_type = wiki_metadata['type']
+                    prefix = wiki_metadata['prefix']
+                    if wiki_type == 'special':
+                        prefix_split = prefix.split('.')
+                        special_name = "NOT_SPECIAL"
+                        if prefix in SPECIAL_WIKIS.keys():
+                            special_name = SPECIAL_WIKIS[prefix][0]
+                            wiki_metadata['code'] = special_name
+                            wiki_metadata['display_name'] = SPECIAL_WIKIS[prefix][1]
+                            wiki_dict[special_name] = wiki_metadata
+                            wiki_host_index[prefix] = special_name
+                        elif prefix.startswith('www.') and 'wikimedia' in prefix and len(prefix_split) == 3 and prefix_split[0].strip():
+                            # maybe a language code as a TLD CC
+                            special_name = prefix_split[-1] + "_wikimedia"
                             wiki_metadata['code'] = special_name
                             wiki_metadata['display_name'] = special_name.capitalize()
                             wiki_dict[special_name] = wiki_metadata
                             wiki_host_index[prefix] = special_name
-                        if special_name == "NOT_SPECIAL":
-                            logger.warning(f"Unable to determine wiki name for special wiki: {wiki_metadata}")
-
-                        # we will skip any special wiki that doesn't match any of these
-                        #logger.warning(f"Not indexing wiki: {wiki_metadata}")
-
-
-                        else:
-                            # record the language short code for non-special wikis if one is present
-                            if prefix:
-                                if prefix in language_dict:
-                                    pass
-                                if prefix in language_dict and language_dict[prefix]['enName'] != wiki_metadata['language']:
-                                    logger.warning(f"Duplicate language code found for code {prefix}: "
-                                                   f"recorded '{language_dict[prefix]['enName']}', skipping '{wiki_metadata['language']}'")
-                                else:
-                                    language_dict[prefix] = {
-                                        'langCode': prefix,
-                                        'enName': wiki_metadata['language'],
-                                        'localName': wiki_metadata['loclang']
-                                    }
-                                wiki_metadata['langCode'] = wiki_metadata['prefix']
-
-                            # index the wiki by wiki_code
-                            if wiki_type not in wiki_types:
-                                logger.debug(f"Adding wiki type {wiki_type} to list of wiki types")
-                            wiki_types[wiki_type] = { 'wikiType': wiki_type }
-                            wiki_code = prefix + "_" + wiki_type
-                            wiki_metadata['code'] = wiki_code
-                            wiki_metadata['display_name'] = wiki_metadata['language'] + " " + wiki_metadata['type'].capitalize()
-                            wiki_dict[wiki_code] = wiki_metadata
-                            wiki_host_index[prefix + "." + wiki_type + ".org"] = wiki_code # a terrible hack but ...
-                    else:
-                        logger.warning(f"Skipping wiki with missing or invalid type: {wiki_metadata}")
+                    elif prefix.endswith('.org') and 'wikimedia' in prefix and len(prefix_split) == 3 and prefix_split[0].strip():
+                        # probably a language code as the host name prefix
+                        special_name = prefix_split[0] +  "_wikimedia"
+                        wiki_metadata['code'] = special_name
+                        wiki_metadata['display_name'] = special_name.capitalize()
+                        wiki_dict[special_name] = wiki_metadata
+                        wiki_host_index[prefix] = special_name
+                    if special_name == "NOT_SPECIAL":
+                        logger.warning(f"Unable to determine wiki name for special wiki: {wiki_metadata}")
 
-                except Exception:
-                    logger.exception(f"Error processing line({wiki_count}): {line}")
+                    # we will skip any special wiki that doesn't match any of these
+                    #logger.warning(f"Not indexing wiki: {wiki_metadata}")
+
+
+                    else:
+                        # record the language short code for non-special wikis if one is present
+                        if prefix:
+                            if prefix in language_dict:
+                                pass
+                            if prefix in language_dict and language_dict[prefix]['enName'] != wiki_metadata['language']:
+                                logger.warning(f"Duplicate language code found for code {prefix}: "
+                                               f"recorded '{language_dict[prefix]['enName']}', skipping '{wiki_metadata['language']}'")
+                            else:
+                                language_dict[prefix] = {
+                                    'langCode': prefix,
+                                    'enName': wiki_metadata['language'],
+                                    'localName': wiki_metadata['loclang']
+                                }
+                            wiki_metadata['langCode'] = wiki_metadata['prefix']
+
+                        # index the wiki by wiki_code
+                        if wiki_type not in wiki_types:
+                            logger.debug(f"Adding wiki type {wiki_type} to list of wiki types")
+                        wiki_types[wiki_type] = { 'wikiType': wiki_type }
+                        wiki_code = prefix + "_" + wiki_type
+                        wiki_metadata['code'] = wiki_code
+                        wiki_metadata['display_name'] = wiki_metadata['language'] + " " + wiki_metadata['type'].capitalize()
+                        wiki_dict[wiki_code] = wiki_metadata
+                        wiki_host_index[prefix + "." + wiki_type + ".org"] = wiki_code # a terrible hack but ...
+                else:
+                    logger.warning(f"Skipping wiki with missing or invalid type: {wiki_metadata}")
+
+            except Exception:
+                logger.exception(f"Error processing line({wiki_count}): {line}")
 
     # manually add wikidata and test wikidata because they aren't in the remote list for some reason
     wiki_code = 'wikidata'
@@ -237,25 +557,108 @@ def load_wikis_list():
     logger.debug(f"Found {len(wiki_list)} wikis listed")
     logger.debug(f"Indexed {len(wiki_dict)} wikis")
 
+    domain_enrichment: dict[str, DomainEnrichment] = {}
+    for domain, wiki_code in wiki_host_index.items():
+        wiki = wiki_dict.get(wiki_code)
+        if wiki is not None:
+            domain_enrichment[domain] = DomainEnrichment(
+                wiki_code, wiki.get('type'), wiki.get('language', 'multi')) # 'multi' is a strong assumption
+
+    return WikiIndex(wiki_list_columns, wiki_types, wiki_list, wiki_dict, language_dict, wiki_host_index,
+                     domain_enrichment)
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set[str]:
+    """
+    :return: the content codings a client accepts, from its Accept-Encoding header
+    """
+    accepted = set()
+    if not accept_encoding:
+        return accepted
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class PreEncodedResponse:
+    """
+    A JSON response serialized and compressed once, with a strong ETag for each encoding, so requests for
+    metadata that only changes when the wiki list is loaded cost a dict lookup, and conditional requests a 304.
+    """
+    __slots__ = ('bodies', 'etags')
+
+    def __init__(self, content):
+        # serialized like FastAPI's JSONResponse, so clients see the same bytes as before
+        body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body, METADATA_COMPRESSION_GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, mode=brotli.MODE_TEXT,
+                                                quality=METADATA_COMPRESSION_BROTLI_QUALITY)
+        self.etags = {encoding: f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+                      for encoding in self.bodies}
+
+    def response(self, if_none_match: Optional[str], accept_encoding: Optional[str]) -> Response:
+        """
+        :return: the response in the best encoding the client accepts, or a 304 if it already has it
+        """
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next((encoding for encoding in ('br', 'gzip') if encoding in accepted and encoding in self.bodies),
+                        'identity')
+        headers = {'ETag': self.etags[encoding], 'Cache-Control': METADATA_CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+        if if_none_match:
+            requested_tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(",")}
+            # only a copy in the encoding this request gets is current; the others are different representations
+            if '*' in requested_tags or self.etags[encoding] in requested_tags:
+                return Response(status_code=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(self.bodies[encoding], media_type="application/json", headers=headers)
+
+
+metadata_responses: dict[str, PreEncodedResponse] = {} # endpoint -> response, replaced by install_wiki_index
+
+
+def build_metadata_responses(index: WikiIndex, tables: "WireFormatTables") -> dict[str, PreEncodedResponse]:
+    """
+    Serialize the metadata endpoint responses from a freshly loaded wiki list.
+    :return: endpoint -> response
+    """
+    wiki_dict, wiki_types, language_dict = index.wiki_dict, index.wiki_types, index.language_dict
+    return {
+        'wikis': PreEncodedResponse({
+            "wikis": wiki_dict,
+        }),
+        'wiki_codes': PreEncodedResponse(
+            [{ 'wikiCode': wc, 'displayName': wiki_dict[wc]['display_name'] } for wc in wiki_dict.keys()]),
+        'types': PreEncodedResponse([ wiki_types[wt] for wt in wiki_types.keys() ]),
+        'languages': PreEncodedResponse([ language_dict[lc] for lc in language_dict.keys()]),
+        'wire_format': PreEncodedResponse(tables.describe()),
+    }
+
 
 @app.get("/api/wikis/")
-async def get_wikis():
+async def get_wikis(if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+                    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding")):
     """
     Get a list of all the wikis, indexed by code
     :return: JSON object with keys as each wiki code, and values as a metadata object for that wiki
     """
-    return {
-        "wikis": wiki_dict,
-    }
+    return metadata_responses['wikis'].response(if_none_match, accept_encoding)
 
 
 @app.get("/api/wiki_codes")
-async def get_wiki_codes():
+async def get_wiki_codes(if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+                         accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding")):
     """
     Get a list of all the wiki codes
     :return: a JSON array containing dicts that contain wiki code and display name for each wiki
     """
-    return  [{ 'wikiCode': wc, 'displayName': wiki_dict[wc]['display_name'] } for wc in wiki_dict.keys()]
+    return metadata_responses['wiki_codes'].response(if_none_match, accept_encoding)
 
 
 @app.get("/api/wiki/{wiki_code}")
@@ -272,43 +675,759 @@ async def get_wiki(wiki_code: str):
 
 
 @app.get("/api/types")
-async def get_wiki_types():
+async def get_wiki_types(if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+                         accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding")):
     """
     Get a list of all the wiki types
     :return: a JSON array containing a list of wiki type dicts
     """
-    return [ wiki_types[wt] for wt in wiki_types.keys() ]
+    return metadata_responses['types'].response(if_none_match, accept_encoding)
 
 
 @app.get("/api/languages")
-async def get_wiki_languages():
+async def get_wiki_languages(if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+                             accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding")):
     """
     Get a list of all the languages
     :return: a JSON array containing dicts of language code, English language name and local language name
     """
-    return [ language_dict[lc] for lc in language_dict.keys()]
+    return metadata_responses['languages'].response(if_none_match, accept_encoding)
 
 
-class EvictingQueue(asyncio.Queue):
+class Histogram:
     """
-    Custom queue (ring buffer, really) that evicts the oldest message when full.
-    Relies on the implementation of Dict to use the global interpreter lock to be thread-safe.
-    see https://wiki.python.org/moin/GlobalInterpreterLock for when this might or might not be true.
+    Fixed-bucket histogram in the Prometheus style. The buckets are allocated once, so observing a value on the
+    hot path is a bisect and two additions.
     """
-    def __init__(self, maxsize=EVENT_QUEUE_SIZE):
-        super().__init__(maxsize)
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def exposition(self, name: str, help_text: str) -> list[str]:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {cumulative}")
+        return lines
+
+
+class RelayMetrics:
+    """
+    Counters and histograms for the relay hot path, exposed at /api/metrics. Everything is preallocated, so
+    leaving the instrumentation on costs an attribute increment or a histogram bucket per event.
 
-    def put_nowait(self, item):
-        if self.full():
-            try:
-                self.get_nowait()
-            except asyncio.QueueEmpty:
-                pass
-        super().put_nowait(item)
+    Only the process connected to the wiki event stream counts what comes in from it. With multiple workers,
+    that is the ingest process, which sends those metrics to its workers now and then for them to expose.
+    """
+    INGEST_COUNTERS = ('events_received', 'events_prefiltered', 'events_filtered', 'events_duplicate',
+                       'events_refined', 'events_offloaded', 'upstream_connects', 'upstream_reconnects')
+
+    __slots__ = (
+        'events_received',
+        'events_prefiltered',
+        'events_filtered',
+        'events_duplicate',
+        'events_refined',
+        'events_offloaded',
+        'events_delivered',
+        'events_evicted',
+        'events_rate_limited',
+        'streams_reaped',
+        'upstream_connects',
+        'upstream_reconnects',
+        'log_messages_sampled',
+        'parse_refine_seconds',
+        'delivery_lag_seconds',
+    )
+
+    def __init__(self):
+        self.events_received = 0 # every event from the wiki event stream
+        self.events_prefiltered = 0 # rejected from the raw data, without parsing
+        self.events_filtered = 0 # rejected after parsing, or unparseable
+        self.events_duplicate = 0 # delivered again by the event stream after resuming
+        self.events_refined = 0
+        self.events_offloaded = 0 # parsed and refined on the parse worker pool rather than the event loop
+        self.events_delivered = 0 # frames written to clients
+        self.events_evicted = 0 # skipped by subscribers that fell a whole ring behind
+        self.events_rate_limited = 0 # skipped for subscribers over their max_rate, before being encoded for them
+        self.streams_reaped = 0 # event streams dropped by the heartbeat scheduler for not completing writes
+        self.upstream_connects = 0
+        self.upstream_reconnects = 0 # connection attempts after a dropped or failed connection
+        self.log_messages_sampled = 0 # repetitive log messages left out and only counted in a summary
+        self.parse_refine_seconds = Histogram((0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005))
+        self.delivery_lag_seconds = Histogram((0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+    def ingest_snapshot(self) -> dict:
+        """
+        :return: the event stream metrics, for an ingest process to send to its workers
+        """
+        snapshot = {name: getattr(self, name) for name in self.INGEST_COUNTERS}
+        snapshot['parse_refine_seconds'] = [self.parse_refine_seconds.counts, self.parse_refine_seconds.sum]
+        return snapshot
+
+    def apply_ingest_snapshot(self, snapshot: dict) -> None:
+        """
+        Take over the event stream metrics an ingest process sent, in a worker process.
+        """
+        for name in self.INGEST_COUNTERS:
+            setattr(self, name, snapshot[name])
+        counts, total = snapshot['parse_refine_seconds']
+        if len(counts) == len(self.parse_refine_seconds.counts):
+            self.parse_refine_seconds.counts = counts
+            self.parse_refine_seconds.sum = total
+
+
+relay_metrics = RelayMetrics()
+
+
+class RefinedEvent(NamedTuple):
+    """
+    An event slimmed down to the essential elements needed to do the audio-visualization. A tuple, since
+    one is made for every relayed event and never changed afterwards.
+    """
+    id: Any # the upstream rc id, or a uuid without one. Not sure if this matters except that Vue wants it to be unique
+    domain: str
+    wiki_type: Optional[str]
+    event_type: str
+    code: str
+    language: str
+    title: Any
+    title_url: Any
+    timestamp: Any
+    user: Any
+    bot: Any
+    change_in_length: int
+    hashtags: Tuple[str, ...] = () # from the edit summary, casefolded and without the "#"
+
+
+class WireFormatTables:
+    """
+    The small integer ids that the compact wire formats send in place of wiki codes, wiki types, languages and
+    event types. Ids are only ever added, never reassigned, so a client holding an older copy of the tables can
+    keep decoding and only needs to fetch them again when it sees an id it doesn't know. The version goes up
+    whenever an id is added.
+    Ids are only assigned from the wiki list, in sorted order, so every process that loaded the same list has the
+    same tables, whichever of them serves the tables and whichever the event stream. Values that aren't in the
+    tables, like the codes of wikis missing from the list, are sent as plain strings instead.
+    """
+    # positions of the refined event fields in a compact event array
+    FIELDS = ('id', 'code', 'wiki_type', 'language', 'event_type', 'title', 'title_url', 'timestamp', 'user', 'bot',
+              'change_in_length', 'domain', 'hashtags')
+    EVENT_TYPES = ('unknown', 'edit', 'new_page', 'new_user')
+
+    def __init__(self):
+        self.version = 0
+        self.codes: dict[Any, int] = {}
+        self.types: dict[Any, int] = {}
+        self.languages: dict[Any, int] = {}
+        self.event_types: dict[Any, int] = {event_type: i for i, event_type in enumerate(self.EVENT_TYPES)}
+        self.extend([""], [""], ["", "multi"])
+
+    def extended(self, codes: Iterable, types: Iterable, languages: Iterable) -> "WireFormatTables":
+        """
+        :return: a copy of the tables, extended with the given values. The tables in use are left as they are, so
+                 events keep being encoded with them while the copy is built.
+        """
+        tables = copy.copy(self)
+        tables.codes, tables.types, tables.languages = dict(self.codes), dict(self.types), dict(self.languages)
+        tables.extend(codes, types, languages)
+        return tables
+
+    def extend(self, codes: Iterable, types: Iterable, languages: Iterable) -> None:
+        """
+        Assign ids to any of the given values that don't have one yet, in sorted order.
+        """
+        for table, values in ((self.codes, codes), (self.types, types), (self.languages, languages)):
+            for value in sorted(set(values).difference(table), key=str):
+                table[value] = len(table)
+                self.version += 1
+
+    def compact(self, refined_event: RefinedEvent) -> list:
+        """
+        :return: the refined event as a positional array, in the order of FIELDS, with ids for the values in the
+                 tables. The domain is only included for events from wikis we don't know, since it can be looked up
+                 by code otherwise.
+        """
+        code = refined_event.code
+        wiki_type = refined_event.wiki_type
+        language = refined_event.language
+        event_type = refined_event.event_type
+        return [refined_event.id, self.codes.get(code, code), self.types.get(wiki_type, wiki_type),
+                self.languages.get(language, language), self.event_types.get(event_type, event_type),
+                refined_event.title,
+                refined_event.title_url, refined_event.timestamp, refined_event.user, refined_event.bot,
+                refined_event.change_in_length, "" if code else refined_event.domain, refined_event.hashtags]
+
+    def describe(self) -> dict:
+        """
+        :return: the tables, as served to clients: each list holds the values in id order
+        """
+        return {
+            'version': self.version,
+            'fields': self.FIELDS,
+            'codes': list(self.codes),
+            'types': list(self.types),
+            'languages': list(self.languages),
+            'eventTypes': list(self.event_types),
+        }
+
+
+wire_format_tables = WireFormatTables()
+
+
+class RelayedEvent:
+    """
+    A refined event together with its sequence id, pre-encoded JSON and SSE frame. One of these is built per event
+    by the relay loop, and the same object is handed to every subscriber, so serialization cost doesn't grow with
+    the number of connected clients. The compact encodings are built the first time a subscriber asks for them.
+    """
+    __slots__ = ('seq', 'event', 'data', 'frame', '_compact_data', '_compact_frame', '_msgpack_data')
+
+    def __init__(self, seq: int, event: RefinedEvent, data: bytes, frame: bytes):
+        self.seq = seq
+        self.event = event
+        self.data = data
+        self.frame = frame
+        self._compact_data = None
+        self._compact_frame = None
+        self._msgpack_data = None
+
+    def compact_data(self) -> bytes:
+        """
+        :return: the encoded JSON bytes of the event as a compact array
+        """
+        if self._compact_data is None:
+            self._compact_data = json.dumps(wire_format_tables.compact(self.event), separators=(',', ':')).encode('utf-8')
+        return self._compact_data
+
+    def compact_frame(self) -> bytes:
+        """
+        :return: an SSE frame holding the event as a compact array
+        """
+        if self._compact_frame is None:
+            self._compact_frame = encode_event_frame(self.seq, self.compact_data())
+        return self._compact_frame
+
+    def msgpack_data(self) -> bytes:
+        """
+        :return: the MessagePack bytes of the sequence id followed by the compact array fields
+        """
+        if self._msgpack_data is None:
+            self._msgpack_data = msgpack.packb([self.seq, *wire_format_tables.compact(self.event)])
+        return self._msgpack_data
+
+
+REFINED_EVENT_TEMPLATE = ('{"id": %s, "domain": %s, "wiki_type": %s, "event_type": %s, "code": %s, "language": %s, '
+                          '"title": %s, "title_url": %s, "timestamp": %s, "user": %s, "bot": %s, '
+                          '"change_in_length": %s, "hashtags": %s}')
+
+
+def encode_json_value(value) -> str:
+    """
+    Encode a single JSON value, taking shortcuts for the types refined events are made of.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return encode_basestring_ascii(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is bool:
+        return 'true' if value else 'false'
+    if value_type is tuple and not value:
+        return '[]'
+    return json.dumps(value)
+
+
+def encode_event_data(refined_event: RefinedEvent) -> bytes:
+    """
+    Serialize a refined event to a JSON object, with orjson when it is installed, or else by filling in a
+    template, which is about twice as fast as encoding a dict with the json module.
+    :param refined_event: the refined event
+    :return: the encoded JSON bytes
+    """
+    if orjson_dumps is not None:
+        return orjson_dumps(dict(zip(RefinedEvent._fields, refined_event)))
+    return (REFINED_EVENT_TEMPLATE % tuple(map(encode_json_value, refined_event))).encode('utf-8')
+
+
+def encode_event_frame(seq: int, data: bytes) -> bytes:
+    """
+    Wrap an encoded refined event into a complete SSE frame, ready to be written to the client as-is.
+    :param seq: the sequence id of the event, sent as the SSE event id so clients can resume from it
+    :param data: the encoded JSON bytes of the refined event
+    :return: the encoded frame bytes
+    """
+    return b"id: %d\nevent: wiki_event\ndata: %b\n\n" % (seq, data)
+
+
+def encode_batch_frame(relayed_events: list[RelayedEvent], wire_format: str = 'json') -> bytes:
+    """
+    Combine several relayed events into one SSE frame holding a JSON array of them, identified by the id of the
+    last one. A single event is sent as its usual frame. MessagePack streams aren't framed, so their events are
+    simply concatenated.
+    :param relayed_events: the events, oldest first
+    :param wire_format: one of WIRE_FORMATS
+    :return: the encoded frame bytes
+    """
+    if wire_format == 'msgpack':
+        return b"".join(relayed_event.msgpack_data() for relayed_event in relayed_events)
+    if len(relayed_events) == 1:
+        return encode_single_frame(relayed_events[0], wire_format)
+    if wire_format == 'compact':
+        data = b",".join(relayed_event.compact_data() for relayed_event in relayed_events)
+    else:
+        data = b",".join(relayed_event.data for relayed_event in relayed_events)
+    return b"id: %d\nevent: wiki_events\ndata: [%b]\n\n" % (relayed_events[-1].seq, data)
+
+
+def encode_single_frame(relayed_event: RelayedEvent, wire_format: str = 'json') -> bytes:
+    """
+    :param wire_format: one of WIRE_FORMATS
+    :return: the bytes to send for a single relayed event in the given wire format
+    """
+    if wire_format == 'compact':
+        return relayed_event.compact_frame()
+    if wire_format == 'msgpack':
+        return relayed_event.msgpack_data()
+    return relayed_event.frame
+
+
+# (codes, wiki types, language names, hashtags) requested by a subscriber
+FilterKey = Tuple[FrozenSet[str], FrozenSet[str], FrozenSet[str], FrozenSet[str]]
+
+
+class SubscriptionGroup:
+    """
+    All the subscribers that requested exactly the same filters. Groups are what the registry indexes, so a
+    thousand browsers listening to English Wikipedia cost one index entry, not a thousand.
+
+    A group holds the events matching its filters in a fixed-size ring, which its subscribers read through their
+    own cursors, and wakes all of them at once through one shared future. Publishing an event to a group is
+    the same small amount of work however many subscribers it has.
+    """
+    __slots__ = ('key', 'subscribers', 'ring', 'head', '_wakeup')
+
+    def __init__(self, key: FilterKey):
+        self.key = key
+        self.subscribers: set[Subscriber] = set()
+        self.ring: list[Optional[RelayedEvent]] = [None] * EVENT_RING_SIZE
+        self.head = 0 # events ever appended; the next one goes into ring[head % EVENT_RING_SIZE]
+        self._wakeup: Optional[asyncio.Future] = None
+
+    def append(self, relayed_event: RelayedEvent) -> None:
+        self.ring[self.head % EVENT_RING_SIZE] = relayed_event
+        self.head += 1
+        self.wake()
+
+    def wake(self) -> None:
+        """
+        Wake every subscriber waiting for events from this group.
+        """
+        wakeup = self._wakeup
+        if wakeup is not None:
+            self._wakeup = None
+            wakeup.set_result(None)
+
+    def wakeup(self) -> asyncio.Future:
+        """
+        :return: a future that is done when the next event is appended
+        """
+        if self._wakeup is None:
+            self._wakeup = asyncio.get_running_loop().create_future()
+        return self._wakeup
+
+
+class Subscriber:
+    """
+    One client's read cursor into the ring of its subscription group. A subscriber that falls a whole ring
+    behind is fast-forwarded to the oldest event still held, and the events it skipped are counted as dropped.
+    """
+    __slots__ = ('group', 'cursor', 'dropped', 'last_write', 'keep_alive_due', 'reaped', '_interrupt')
+
+    def __init__(self):
+        self.group: Optional[SubscriptionGroup] = None
+        self.cursor = 0
+        self.dropped = 0
+        self.last_write = 0 # heartbeat_scheduler.tick when a write to the client last completed
+        self.keep_alive_due = False # set by the heartbeat scheduler when the client has been idle for a while
+        self.reaped = False # set by the heartbeat scheduler when the client stopped reading, to end the stream
+        self._interrupt: Optional[asyncio.Future] = None
+
+    def join(self, group: Optional[SubscriptionGroup]) -> None:
+        """
+        Start reading from a group's newest event on, or stop reading when the group is None.
+        """
+        self.group = group
+        self.cursor = group.head if group is not None else 0
+        self.interrupt() # so a waiter starts waiting on the new group
+
+    def interrupt(self) -> None:
+        """
+        Wake a waiting subscriber without an event to read.
+        """
+        interrupt = self._interrupt
+        if interrupt is not None and not interrupt.done():
+            interrupt.set_result(None)
+
+    def pending(self) -> int:
+        """
+        :return: the number of events waiting to be read
+        """
+        group = self.group
+        return min(group.head - self.cursor, EVENT_RING_SIZE) if group is not None else 0
+
+    def read(self) -> list[RelayedEvent]:
+        """
+        :return: every event waiting to be read, oldest first, moving the cursor past them
+        """
+        group = self.group
+        if group is None:
+            return []
+        head = group.head
+        cursor = self.cursor
+        if head - cursor > EVENT_RING_SIZE:
+            skipped = head - cursor - EVENT_RING_SIZE
+            self.dropped += skipped
+            relay_metrics.events_evicted += skipped
+            cursor = head - EVENT_RING_SIZE
+        ring = group.ring
+        self.cursor = head
+        return [ring[i % EVENT_RING_SIZE] for i in range(cursor, head)]
+
+    async def wait(self) -> None:
+        """
+        Wait until there is an event to read, or until interrupted, as when the subscription changes. There is no
+        timeout, so waiting costs no timer; the heartbeat scheduler interrupts idle subscribers instead.
+        """
+        group = self.group
+        if group is not None and self.cursor < group.head:
+            return
+        self._interrupt = interrupt = asyncio.get_running_loop().create_future()
+        try:
+            if group is None:
+                await interrupt
+            else:
+                await asyncio.wait((interrupt, group.wakeup()), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._interrupt = None
+
+
+class SubscriptionRegistry:
+    """
+    Inverted index of subscribers by wiki code, wiki type and language name. The relay loop routes each event
+    with three dict lookups to the groups whose filters match, so subscribers are only woken up for events
+    they actually asked for.
+
+    Groups that asked for hashtags are indexed by hashtag alone, since they only want events carrying one of
+    them, and their other filters narrow those down further. An event is looked up there once per hashtag in
+    its edit summary, which most events don't have.
+    """
+    def __init__(self):
+        self._groups: dict[FilterKey, SubscriptionGroup] = {}
+        self._subscriptions: dict[Subscriber, SubscriptionGroup] = {}
+        self._by_code: dict[str, set[SubscriptionGroup]] = {}
+        self._by_type: dict[str, set[SubscriptionGroup]] = {}
+        self._by_language: dict[str, set[SubscriptionGroup]] = {}
+        self._by_hashtag: dict[str, set[SubscriptionGroup]] = {}
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def __iter__(self):
+        return iter(self._subscriptions)
+
+    def __contains__(self, subscriber):
+        return subscriber in self._subscriptions
+
+    def group_count(self) -> int:
+        return len(self._groups)
+
+    def _indexes(self, key: FilterKey):
+        if key[3]:
+            return ((self._by_hashtag, key[3]),)
+        return zip((self._by_code, self._by_type, self._by_language), key)
+
+    def subscribe(self, subscriber: Subscriber, codes: Iterable[str], types: Iterable[str],
+                  language_names: Iterable[str], hashtags: Iterable[str] = ()) -> None:
+        """
+        Register a subscriber with its requested filters. It reads the events published from now on.
+        """
+        key: FilterKey = (frozenset(codes), frozenset(types), frozenset(language_names), frozenset(hashtags))
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = SubscriptionGroup(key)
+            for index, values in self._indexes(key):
+                for value in values:
+                    index.setdefault(value, set()).add(group)
+        group.subscribers.add(subscriber)
+        self._subscriptions[subscriber] = group
+        subscriber.join(group)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """
+        Remove a subscriber, dropping its group from the indexes if it was the last member.
+        """
+        group = self._subscriptions.pop(subscriber, None)
+        if group is None:
+            return
+        group.subscribers.discard(subscriber)
+        subscriber.join(None)
+        if not group.subscribers:
+            del self._groups[group.key]
+            for index, values in self._indexes(group.key):
+                for value in values:
+                    index_groups = index[value]
+                    index_groups.discard(group)
+                    if not index_groups:
+                        del index[value]
+
+    def update(self, subscriber: Subscriber, codes: Iterable[str], types: Iterable[str],
+               language_names: Iterable[str], hashtags: Iterable[str] = ()) -> None:
+        """
+        Change the filters of a subscriber in place. It reads the events matching its new filters from now on.
+        """
+        self.unsubscribe(subscriber)
+        self.subscribe(subscriber, codes, types, language_names, hashtags)
+
+    def clear(self) -> None:
+        for subscriber in list(self._subscriptions):
+            self.unsubscribe(subscriber)
+
+    def matching_groups(self, code: str, wiki_type: str, language: str) -> set[SubscriptionGroup]:
+        """
+        Find the groups whose filters match an event with the given code, wiki type and language.
+        """
+        groups = set()
+        for index, value in ((self._by_code, code), (self._by_type, wiki_type), (self._by_language, language)):
+            index_groups = index.get(value)
+            if index_groups:
+                groups |= index_groups
+        return groups
+
+    def hashtag_groups(self, refined_event: RefinedEvent) -> set[SubscriptionGroup]:
+        """
+        Find the groups that asked for any of an event's hashtags, and whose other filters match it too.
+        """
+        groups = set()
+        for hashtag in refined_event.hashtags:
+            for group in self._by_hashtag.get(hashtag, ()):
+                if group not in groups and filter_pass(refined_event, *group.key):
+                    groups.add(group)
+        return groups
+
+    def publish(self, relayed_event: RelayedEvent) -> None:
+        """
+        Deliver a relayed event to every subscription group whose filters match it.
+        """
+        refined_event = relayed_event.event
+        groups = self.matching_groups(refined_event.code, refined_event.wiki_type, refined_event.language)
+        if refined_event.hashtags and self._by_hashtag:
+            groups |= self.hashtag_groups(refined_event)
+        for group in groups:
+            group.append(relayed_event)
 
 
 # Global subscriber registry
-active_subscribers: Set[EvictingQueue] = set()
+subscription_registry = SubscriptionRegistry()
+
+
+class ReplayBuffer:
+    """
+    Bounded, time-windowed buffer of the most recently relayed events, in sequence order. Clients that reconnect
+    with a Last-Event-ID are served the events they missed from here, instead of coming back cold.
+    """
+    def __init__(self, maxlen: int = REPLAY_BUFFER_SIZE, max_age: float = REPLAY_BUFFER_SECONDS):
+        self.max_age = max_age
+        self._events: deque[tuple[float, RelayedEvent]] = deque(maxlen=maxlen)
+
+    def __len__(self):
+        return len(self._events)
+
+    def append(self, relayed_event: RelayedEvent, now: float) -> None:
+        """
+        :param now: time.monotonic() when the event was published
+        """
+        events = self._events
+        while events and now - events[0][0] > self.max_age:
+            events.popleft()
+        events.append((now, relayed_event))
+
+    def clear(self) -> None:
+        self._events.clear()
+
+    def since(self, last_seq: int, codes, types, language_names, hashtags=()) -> list[RelayedEvent]:
+        """
+        Find the buffered events newer than the given sequence id that match the given filters.
+        :param last_seq: the sequence id of the last event the client received
+        :return: the matching events, oldest first
+        """
+        events = self._events
+        start = bisect.bisect_right(events, last_seq, key=lambda entry: entry[1].seq)
+        return [relayed_event for _, relayed_event in itertools.islice(events, start, None)
+                if filter_pass(relayed_event.event, codes, types, language_names, hashtags)]
+
+
+replay_buffer = ReplayBuffer()
+
+
+class RateWheel:
+    """
+    Count of one wiki's events over the last RATE_WINDOW_SECONDS, held as a ring of per-bucket counts and their
+    running total. Buckets are cleared as time moves past them, the next time the wheel is touched, so counting an
+    event is a bucket increment rather than a timestamp to keep and prune.
+    """
+    __slots__ = ('buckets', 'tick', 'total', 'wiki_type', 'language')
+
+    def __init__(self, tick: int, wiki_type: str, language: str):
+        self.buckets = [0] * RATE_BUCKETS
+        self.tick = tick # the bucket currently counting, in RATE_BUCKET_SECONDS since an arbitrary start
+        self.total = 0
+        self.wiki_type = wiki_type
+        self.language = language
+
+    def advance(self, tick: int) -> None:
+        """
+        Move the window forward, dropping the counts of buckets that fell out of it.
+        """
+        elapsed = tick - self.tick
+        if elapsed <= 0:
+            return
+        buckets = self.buckets
+        if elapsed >= RATE_BUCKETS:
+            buckets[:] = [0] * RATE_BUCKETS
+            self.total = 0
+        else:
+            for i in range(self.tick + 1, tick + 1):
+                i %= RATE_BUCKETS
+                self.total -= buckets[i]
+                buckets[i] = 0
+        self.tick = tick
+
+
+class RateCounters:
+    """
+    Sliding-window event rates for every wiki code, wiki type and language, counted as events are relayed, so
+    clients can show the activity of wikis they aren't subscribed to. Each event is counted once, against its wiki;
+    a wiki always has the same type and language, so their rates are summed from the wikis' when a snapshot is
+    taken. Counts only cover the time the relay is connected to the wiki event stream, which it is while anyone is
+    subscribed to events or to the rates stream.
+    """
+    def __init__(self):
+        self.wheels: dict[str, RateWheel] = {} # wiki code -> wheel
+        self._snapshot: Optional[Tuple[int, bytes]] = None # (tick, encoded snapshot)
+
+    def count(self, refined_event: RefinedEvent, now: float) -> None:
+        """
+        :param now: time.monotonic() when the event was published
+        """
+        tick = int(now // RATE_BUCKET_SECONDS)
+        wheel = self.wheels.get(refined_event.code)
+        if wheel is None:
+            wheel = self.wheels[refined_event.code] = RateWheel(tick, refined_event.wiki_type, refined_event.language)
+        elif wheel.tick != tick:
+            wheel.advance(tick)
+        wheel.buckets[tick % RATE_BUCKETS] += 1
+        wheel.total += 1
+
+    def snapshot(self) -> bytes:
+        """
+        :return: the current rates as a JSON object, serialized at most once per RATE_BUCKET_SECONDS
+        """
+        tick = int(time.monotonic() // RATE_BUCKET_SECONDS)
+        if self._snapshot is not None and self._snapshot[0] == tick:
+            return self._snapshot[1]
+        codes, types, languages = {}, {}, {}
+        for code, wheel in list(self.wheels.items()):
+            wheel.advance(tick)
+            if not wheel.total:
+                del self.wheels[code] # forget wikis without recent events
+                continue
+            for rates, key in ((codes, code), (types, wheel.wiki_type), (languages, wheel.language)):
+                if key:
+                    rates[key] = rates.get(key, 0) + wheel.total
+        scale = 60 / RATE_WINDOW_SECONDS # to events per minute
+        content = {'windowSeconds': RATE_WINDOW_SECONDS}
+        for name, rates in (('codes', codes), ('types', types), ('languages', languages)):
+            content[name] = {key: round(total * scale, 1) for key, total in rates.items()}
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+        self._snapshot = (tick, body)
+        return body
+
+
+rate_counters = RateCounters()
+rate_stream_count = 0 # connected /api/rates/stream clients, which keep the relay connected like subscribers do
+
+# Sequence ids for relayed events. Starting from the clock keeps them increasing across restarts, so a client
+# resuming against a freshly started process never mistakes new events for ones it already has.
+event_sequence = itertools.count(time.time_ns() // 1000)
+
+
+# Patterns used to reject raw event payloads before they are parsed. See prefilter_raw_event.
+RAW_TYPE_PATTERN = re.compile(r'"type"\s*:\s*"([^"]*)"(?:\s*,\s*"namespace"\s*:\s*(-?\d+)\s*[,}])?')
+RAW_MAIN_NAMESPACE_PATTERN = re.compile(r'"namespace"\s*:\s*-?0\s*[,}]')
+RAW_NEWUSERS_PATTERN = re.compile(r'"log_type"\s*:\s*"newusers"')
+# The prefilter only pays off against the standard library's JSON decoder. orjson parses an event in not much
+# more time than the prefilter scans it, so with orjson every event is parsed rather than scanned first.
+PREFILTER_RAW_EVENTS = orjson_dumps is None
+
+
+def prefilter_raw_event(data: str) -> bool:
+    """
+    Cheaply decide from the raw SSE data whether an event could possibly pass accept_raw_event, without building
+    the full dict. This is conservative: it only rejects payloads that the full check would certainly reject, and
+    lets anything ambiguous (a nested "type" key first, escaped values) through to the full parse.
+
+    The event stream puts the type near the start, followed by the namespace, so one search for the first "type"
+    key usually settles it without scanning the rest of the payload.
+    :param data: the raw JSON text of the SSE event
+    :return: False if the event can be dropped without parsing, True if it needs a full parse
+    """
+    match = RAW_TYPE_PATTERN.search(data)
+    if match is None:
+        return True
+    event_type, namespace = match.groups()
+    if event_type == 'edit' or event_type == 'new':
+        if namespace is None:
+            passes = RAW_MAIN_NAMESPACE_PATTERN.search(data) is not None
+        else:
+            passes = int(namespace) == 0
+    elif event_type == 'log':
+        passes = RAW_NEWUSERS_PATTERN.search(data) is not None
+    else:
+        passes = '\\' in event_type
+    if passes:
+        return True
+    # only reject on the top-level type, so check the match isn't nested in an object. Braces in the strings before
+    # it would throw the count off, and then the event is parsed to be sure.
+    start = match.start()
+    return data.count('{', 0, start) - data.count('}', 0, start) != 1
+
+
+def accept_raw_event(raw_event: dict) -> bool:
+    """
+    Determine whether a parsed raw event is one we relay: edits or new pages in namespace 0, or new users.
+    :param raw_event: the parsed raw event
+    :return: True if the event should be refined and relayed
+    :raises KeyError: if the event is missing its type, namespace or log type
+    """
+    re_type = raw_event['type']
+    ns = raw_event['namespace']
+    # an integer zero, as a JSON decoder would produce it; false and 0.0 don't count
+    main_namespace = type(ns) is int and ns == 0
+    return ((re_type == 'edit' and main_namespace) or
+            (re_type == 'log' and raw_event['log_type'] == 'newusers') or
+            (re_type == 'new' and main_namespace))
 
 
 def compute_length_change(raw_event):
@@ -321,205 +1440,1053 @@ def compute_length_change(raw_event):
     return new_length - old_length
 
 
-def refine_event(raw_event):
+UNKNOWN_DOMAIN = DomainEnrichment("", "", "")
+# a "#" at the start of the summary or after whitespace, then word characters with at least one letter, so links
+# to sections like [[Page#Section]] and numbers like #1 aren't taken for hashtags
+HASHTAG_PATTERN = re.compile(r'(?:^|(?<=\s))#(\w*[^\W\d_]\w*)')
+
+
+def extract_hashtags(comment) -> Tuple[str, ...]:
+    """
+    :param comment: an edit summary
+    :return: the hashtags in the summary, casefolded and without the "#", in order and without repeats
+    """
+    if type(comment) is not str or '#' not in comment:
+        return ()
+    return tuple(dict.fromkeys(hashtag.casefold() for hashtag in HASHTAG_PATTERN.findall(comment)))
+
+
+def normalize_hashtags(hashtags: Iterable[str]) -> list[str]:
+    """
+    :return: requested hashtags as they are matched against events: casefolded, without the "#"
+    """
+    return [hashtag for hashtag in (value.strip().lstrip('#').casefold() for value in hashtags) if hashtag]
+
+
+def refine_event(raw_event) -> RefinedEvent:
     """
     Given a raw event body from httpx, slim it down to the essential elements needed to do the audio-visualization
     :param raw_event: The raw event from httpx
-    :return: a refined event object, basically a nested tree of dicts that FastAPI can easily transform to JSON
+    :return: a refined event
     """
     try:
-        refined_event = {
-            "id": raw_event.get('id', uuid4()), # not sure if this matters except that Vue wants it to be unique
-            "domain": raw_event['meta']['domain'] if 'meta' in raw_event and 'domain'in raw_event['meta'] else "",
-            "wiki_type": "", # we don't know yet
-            "event_type": "unknown", # we don't know yet
-            "code": "", # we don't know yet
-            "language": "", # we don't know yet
-            "title": raw_event['title'] if 'title' in raw_event else "",
-            "title_url": raw_event['title_url'] if 'title_url' in raw_event else "",
-            "timestamp": raw_event['timestamp'] if 'timestamp' in raw_event else "",
-            "user": raw_event['user'] if 'user' in raw_event else "",
-            "bot": raw_event['bot'] if 'bot' in raw_event else "",
-            "change_in_length": compute_length_change(raw_event),
-        }
+        domain = raw_event['meta']['domain']
+        code, wiki_type, language = domain_enrichment.get(domain, UNKNOWN_DOMAIN)
+
+        # see if they are "new page" or "new user" events
+        raw_type = raw_event['type']
+        if raw_type == 'edit':
+            event_type = 'edit'
+        elif raw_type == 'new':
+            event_type = 'new_page'
+        elif raw_type == 'log' and raw_event['log_type'] == 'newusers':
+            event_type = 'new_user'
+        else:
+            event_type = 'unknown'
+
+        event_id = raw_event.get('id')
+        if event_id is None:
+            event_id = str(uuid4())
+        get = raw_event.get
+        return RefinedEvent(event_id, domain, wiki_type, event_type, code, language, get('title', ""),
+                            get('title_url', ""), get('timestamp', ""), get('user', ""), get('bot', ""),
+                            compute_length_change(raw_event), extract_hashtags(get('comment')))
     except Exception:
-        logger.exception(f"Error processing raw event: {raw_event}")
+        event_error_log.log("Error processing raw event: %s", raw_event, exc_info=True)
         raise
 
-    if raw_event['meta']['domain'] in wiki_host_index.keys():
-        try:
-            wiki_code = wiki_host_index[raw_event['meta']['domain']]
-            wiki = wiki_dict[wiki_code]
-            refined_event['code'] = wiki_code
-            refined_event['wiki_type'] = wiki['type'] if 'type' in wiki else None
-            refined_event['language'] = wiki['language'] if 'language' in wiki else 'multi' # a strong assumption
-        except Exception:
-            logger.exception(f"Error enriching refined event: {raw_event}")
 
-    # see if they are "new page" or "new user" events
-    if raw_event['type'] == 'log' and raw_event['log_type'] and raw_event['log_type'] == 'newusers':
-        refined_event['event_type'] = 'new_user'
-    elif raw_event['type'] == 'new':
-        refined_event['event_type'] = 'new_page'
-    elif raw_event['type'] == 'edit':
-        refined_event['event_type'] = 'edit'
+class ParsedEvent(NamedTuple):
+    """
+    The outcome of parsing and refining one upstream event, on the event loop or on a parse worker.
+    """
+    outcome: str # "prefiltered" or "filtered" if the event isn't relayed, otherwise "refined"
+    upstream_id: Optional[str] = None
+    refined_event: Optional[RefinedEvent] = None
+    data: Optional[bytes] = None # the encoded refined event, when a parse worker encoded it already
+    seconds: float = 0.0 # time spent parsing and refining
+
+
+PREFILTERED_EVENT = ParsedEvent('prefiltered')
+FILTERED_EVENT = ParsedEvent('filtered')
+
+
+def parse_raw_event(data: str, encode: bool = False) -> ParsedEvent:
+    """
+    Fast-filter, parse and refine the raw SSE data of one upstream event.
+    :param data: the raw JSON text of the SSE event
+    :param encode: also encode the refined event, so the event loop doesn't have to
+    """
+    try:
+        # fast-filter events that aren't edits or new pages in namespace 0, or new users,
+        # first on the raw text and then on the parsed event for whatever survives
+        if PREFILTER_RAW_EVENTS and not prefilter_raw_event(data):
+            return PREFILTERED_EVENT
+        parse_started = time.perf_counter()
+        raw_event = json_loads(data)
+        if not accept_raw_event(raw_event):
+            return FILTERED_EVENT
+        upstream_id = raw_event['meta'].get('id') if 'meta' in raw_event else None
+        refined_event = refine_event(raw_event)
+    except:
+        return FILTERED_EVENT  # if the event doesn't have parseable JSON data or a namespace, skip it.
+    if refined_event.event_type == 'unknown':
+        return FILTERED_EVENT
+    return ParsedEvent('refined', upstream_id, refined_event, encode_event_data(refined_event) if encode else None,
+                       time.perf_counter() - parse_started)
+
+
+def parse_raw_events(batch: list[str]) -> list[ParsedEvent]:
+    """
+    Parse and refine a batch of upstream events on a parse worker.
+    """
+    return [parse_raw_event(data, encode=True) for data in batch]
+
 
-    return refined_event
+def init_parse_worker(enrichment: dict[str, "DomainEnrichment"]) -> None:
+    """
+    Set up a parse worker process with the domain index to refine events with.
+    """
+    global domain_enrichment
+    domain_enrichment = enrichment
 
 
-async def filter_pass(refined_event, requested_codes, requested_types, requested_langs) -> bool:
+def filter_pass(refined_event: RefinedEvent, requested_codes, requested_types, requested_langs,
+                requested_hashtags=()) -> bool:
     """
-    Given a refined event, determine whether the event matches the requested filters. They are inclusive only.
+    Given a refined event, determine whether the event matches the requested filters. Codes, types and languages
+    are inclusive only. Requested hashtags narrow them down instead: the event must carry one of them, and then
+    match the other filters, if there are any.
     :return: True if the event matches the filters, False otherwise.
     """
-    # logger.debug(f"Code: '{refined_event['code']}', requested codes: {requested_codes}, "
-    #              f"Type: '{refined_event['type']}', requested types: {requested_types}, "
-    #              f"Language: '{refined_event['language']}', requested languages: {requested_langs}")
+    # logger.debug(f"Code: '{refined_event.code}', requested codes: {requested_codes}, "
+    #              f"Type: '{refined_event.wiki_type}', requested types: {requested_types}, "
+    #              f"Language: '{refined_event.language}', requested languages: {requested_langs}")
     try:
-        return (refined_event['code'] in requested_codes or
-            refined_event['wiki_type'] in requested_types or
-            refined_event['language'] in requested_langs)
+        if requested_hashtags:
+            if requested_hashtags.isdisjoint(refined_event.hashtags):
+                return False
+            if not (requested_codes or requested_types or requested_langs):
+                return True
+        return (refined_event.code in requested_codes or
+            refined_event.wiki_type in requested_types or
+            refined_event.language in requested_langs)
     except Exception:
-        logger.error(f"Error filtering refined event: {refined_event}")
+        event_error_log.log("Error filtering refined event: %s", refined_event)
         raise
 
 
+# Worker processes attached to this process when it runs as an ingest server: writer -> worker has subscribers
+worker_connections: dict[asyncio.StreamWriter, bool] = {}
+
+
+def has_subscribers() -> bool:
+    """
+    :return: True if anyone wants events from the wiki event stream, whether local clients, rates stream clients or
+             attached workers
+    """
+    return bool(subscription_registry) or bool(rate_stream_count) or any(worker_connections.values())
+
+
+def publish_refined_event(refined_event: RefinedEvent, data: Optional[bytes] = None) -> None:
+    """
+    Serialize a refined event once, then hand it to every matching local subscriber and to every attached
+    worker process. Workers get every event whether they have subscribers or not, so their replay buffers have no
+    gaps when a client resumes with Last-Event-ID on a different worker than it left.
+    :param refined_event: the refined event
+    :param data: the refined event already encoded, if a parse worker did that
+    """
+    seq = next(event_sequence)
+    if data is None:
+        data = encode_event_data(refined_event)
+    if worker_connections:
+        line = b"%d %b\n" % (seq, data)
+        for writer in worker_connections:
+            if writer.transport.get_write_buffer_size() < RELAY_WORKER_BUFFER_LIMIT:
+                writer.write(line)
+    publish_relayed_event(RelayedEvent(seq, refined_event, data, encode_event_frame(seq, data)))
+
+
+def publish_encoded_event(line: bytes) -> None:
+    """
+    Hand an event that was already refined and encoded by the ingest process to every matching local subscriber.
+    :param line: the sequence id and encoded JSON bytes of the refined event, separated by a space
+    """
+    seq, data = line.split(b" ", 1)
+    seq = int(seq)
+    publish_relayed_event(RelayedEvent(seq, RefinedEvent(**json_loads(data)), data, encode_event_frame(seq, data)))
+
+
+def publish_relayed_event(relayed_event: RelayedEvent) -> None:
+    """
+    Keep a relayed event for resuming clients, and deliver it to every matching local subscriber.
+    """
+    now = time.monotonic()
+    replay_buffer.append(relayed_event, now)
+    rate_counters.count(relayed_event.event, now)
+    subscription_registry.publish(relayed_event)
+
+
+class StreamCheckpoint:
+    """
+    The id of the last event received from the wiki event stream, written now and then to a small local file so
+    that reconnects and process restarts can resume from it with Last-Event-ID instead of starting from "now".
+
+    The newest relayed upstream event ids are saved along with it, and every id relayed since is appended to a
+    journal next to it, so that after a restart, even one that came without a chance to save, the events the
+    stream delivers again from the checkpoint on are still recognized as relayed already.
+    """
+    def __init__(self, recent_event_ids: "RecentEventIds", path: str = STREAM_CHECKPOINT_PATH):
+        self.path = path
+        self.journal_path = path + ".ids"
+        self.recent_event_ids = recent_event_ids
+        self.last_event_id: Optional[str] = None
+        self.received_at = 0.0 # wall clock time, so it still means something after a restart
+        self._saved_event_id: Optional[str] = None
+        self._saved_at = 0.0
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            self.last_event_id = self._saved_event_id = saved['last_event_id']
+            self.received_at = saved['received_at']
+            for event_id in saved.get('recent_event_ids', ()):
+                self.recent_event_ids.add(event_id)
+            logger.info(f"Loaded wiki event stream checkpoint: {self.last_event_id}")
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception(f"Ignoring unreadable wiki event stream checkpoint {self.path}")
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self.recent_event_ids.add(line.strip())
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception(f"Ignoring unreadable relayed event journal {self.journal_path}")
+        try:
+            self.recent_event_ids.journal = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except OSError:
+            logger.exception(f"Unable to open relayed event journal {self.journal_path}")
+
+    def update(self, event_id: Optional[str]) -> None:
+        if not event_id:
+            return
+        self.last_event_id = event_id
+        self.received_at = time.time()
+        if time.monotonic() - self._saved_at > STREAM_CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Atomically replace the checkpoint file, if anything changed since it was last written.
+        """
+        self._saved_at = time.monotonic()
+        if self.last_event_id is None or self.last_event_id == self._saved_event_id:
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'last_event_id': self.last_event_id, 'received_at': self.received_at,
+                           'recent_event_ids': self.recent_event_ids.newest(RECENT_EVENT_IDS_SAVED)}, f)
+            os.replace(temp_path, self.path)
+            self._saved_event_id = self.last_event_id
+            self.recent_event_ids.truncate_journal()  # the checkpoint has those ids now
+        except OSError:
+            logger.exception(f"Unable to write wiki event stream checkpoint {self.path}")
+
+    def discard(self) -> None:
+        """
+        Forget the checkpoint, so the next connection starts from "now". Used after deliberately disconnecting.
+        """
+        self.last_event_id = self._saved_event_id = None
+        self.recent_event_ids.truncate_journal()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception(f"Unable to remove wiki event stream checkpoint {self.path}")
+
+    def resume_id(self) -> Optional[str]:
+        """
+        :return: the event id to resume from, or None if there is none or it is too old to be worth resuming
+        """
+        if self.last_event_id and time.time() - self.received_at < STREAM_RESUME_MAX_AGE:
+            return self.last_event_id
+        return None
+
+
+class RecentEventIds:
+    """
+    Bounded set of the most recently relayed upstream event ids, to drop events the event stream delivers again
+    after we resume from a checkpoint. StreamCheckpoint keeps them across restarts.
+    """
+    def __init__(self, maxlen: int = RECENT_EVENT_IDS_SIZE):
+        self.maxlen = maxlen
+        self._ids: set[str] = set()
+        self._order: deque[str] = deque()
+        self.journal: Optional[int] = None # file descriptor new ids are appended to, see StreamCheckpoint
+
+    def add(self, event_id: str) -> bool:
+        """
+        :return: True if the id is new, False if it was seen recently
+        """
+        if event_id in self._ids:
+            return False
+        self._ids.add(event_id)
+        self._order.append(event_id)
+        if len(self._order) > self.maxlen:
+            self._ids.discard(self._order.popleft())
+        if self.journal is not None:
+            try:
+                # unbuffered, so the id is on record even if the process is killed right after
+                os.write(self.journal, event_id.encode('utf-8') + b"\n")
+            except OSError:
+                logger.exception("Unable to append to the relayed event journal, no longer keeping it")
+                self.journal = None
+        return True
+
+    def newest(self, count: int) -> list[str]:
+        """
+        :return: up to count of the most recently added ids, oldest first
+        """
+        return list(itertools.islice(self._order, max(0, len(self._order) - count), None))
+
+    def truncate_journal(self) -> None:
+        if self.journal is not None:
+            try:
+                os.ftruncate(self.journal, 0)
+            except OSError:
+                logger.exception("Unable to truncate the relayed event journal")
+
+
+def reconnect_delay(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, so a flapping event stream isn't hammered by reconnects.
+    :param attempt: how many connection attempts in a row have failed
+    :return: seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** attempt))
+
+
+def relay_parsed_event(parsed: ParsedEvent, recent_event_ids: RecentEventIds) -> None:
+    """
+    Count a parsed upstream event, and publish it unless it was filtered out or was relayed already.
+    """
+    outcome = parsed.outcome
+    if outcome == 'prefiltered':
+        relay_metrics.events_prefiltered += 1
+    elif outcome == 'filtered':
+        relay_metrics.events_filtered += 1
+    elif parsed.upstream_id and not recent_event_ids.add(parsed.upstream_id):
+        relay_metrics.events_duplicate += 1  # already relayed before we resumed
+    else:
+        relay_metrics.parse_refine_seconds.observe(parsed.seconds)
+        relay_metrics.events_refined += 1
+        publish_refined_event(parsed.refined_event, parsed.data)
+
+
+class ParseOffload:
+    """
+    Optional pipeline stage between reading the wiki event stream and publishing. While events come in faster
+    than PARSE_OFFLOAD_RATE a second, or the event loop is lagging, they are collected into small batches that are
+    parsed, refined and encoded on a pool of worker processes, so a burst upstream doesn't hold up deliveries to
+    clients. A task of its own publishes the batches in the order they were read. When things calm down, events
+    are parsed on the event loop again, after every batch still in flight is published.
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.active = False
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.recent_event_ids: Optional[RecentEventIds] = None
+        self.batch: list[str] = []
+        self.batch_started = 0.0
+        self.in_flight: Optional[asyncio.Queue] = None # (event count, future parse results) of batches, in order
+        self.pending = 0 # events submitted to the pool and not published yet
+        self.publisher: Optional[asyncio.Task] = None
+        self.rate_window_started = 0.0
+        self.rate_window_count = 0
+
+    def start(self, recent_event_ids: RecentEventIds) -> None:
+        self.recent_event_ids = recent_event_ids
+
+    def should_offload(self, now: float) -> bool:
+        """
+        Count an upstream event, and decide once a second whether events should be parsed on the pool, from the
+        upstream rate and the event loop lag.
+        :param now: time.monotonic()
+        """
+        self.rate_window_count += 1
+        elapsed = now - self.rate_window_started
+        if elapsed >= 1:
+            rate = self.rate_window_count / elapsed
+            lag = heartbeat_scheduler.loop_lag
+            if not self.active and (rate >= PARSE_OFFLOAD_RATE or lag >= PARSE_OFFLOAD_LOOP_LAG):
+                logger.info(f"Parsing events on {self.workers} worker processes at {rate:.0f} events/s, "
+                            f"event loop lag {lag:.3f}s")
+                self.active = True
+            elif self.active and rate < PARSE_OFFLOAD_RATE / 2 and lag < PARSE_OFFLOAD_LOOP_LAG / 2:
+                logger.info(f"Parsing events on the event loop again at {rate:.0f} events/s")
+                self.active = False
+            self.rate_window_started = now
+            self.rate_window_count = 0
+        return self.active
+
+    async def submit(self, data: str, now: float) -> None:
+        """
+        Add the raw data of an upstream event to the batch, sending the batch off when it is full or old enough.
+        """
+        if not self.batch:
+            self.batch_started = now
+        self.batch.append(data)
+        if len(self.batch) >= PARSE_BATCH_SIZE or now - self.batch_started >= PARSE_BATCH_MAX_DELAY:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Send the batch off to be parsed, waiting if too many batches are in flight already.
+        """
+        if not self.batch:
+            return
+        if self.publisher is None:
+            self.in_flight = asyncio.Queue(self.workers * PARSE_BATCHES_IN_FLIGHT)
+            self.publisher = asyncio.create_task(self.publish_batches())
+        batch, self.batch = self.batch, []
+        self.pending += len(batch)
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.start_pool(), parse_raw_events, batch)
+        except BrokenProcessPool:
+            self.restart_pool()
+            future = asyncio.get_running_loop().run_in_executor(self.start_pool(), parse_raw_events, batch)
+        await self.in_flight.put((len(batch), future))
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # spawned rather than forked, so the workers don't inherit the state of the running server
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=init_parse_worker, initargs=(domain_enrichment,))
+        return self.pool
+
+    async def drain(self) -> None:
+        """
+        Publish every event submitted so far, before events are parsed on the event loop again.
+        """
+        await self.flush()
+        if self.in_flight is not None:
+            await self.in_flight.join()
+
+    async def publish_batches(self):
+        """
+        Background task: publish the parsed batches in order, as they complete.
+        """
+        while True:
+            count, future = await self.in_flight.get()
+            try:
+                parsed_events = await future
+            except Exception as e:
+                # most likely a worker process died, which breaks the pool
+                logger.error(f"Dropping a batch of {count} events that failed to parse: {e!r}")
+                relay_metrics.events_filtered += count
+                self.restart_pool()
+            else:
+                relay_metrics.events_offloaded += count
+                for parsed in parsed_events:
+                    relay_parsed_event(parsed, self.recent_event_ids)
+            finally:
+                self.pending -= count
+                self.in_flight.task_done()
+
+    def restart_pool(self) -> None:
+        """
+        Start new worker processes for the next batch, as when the domain index they refine with has changed.
+        Batches already submitted finish on the old ones.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def stop(self) -> None:
+        if self.publisher is not None:
+            self.publisher.cancel()
+            self.publisher = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.batch = []
+        self.pending = 0
+        self.active = False
+
+
+parse_offload = ParseOffload(PARSE_WORKERS)
+
+
 async def edit_event_relay_loop():
     """
     Background task: connect to the event stream when there are subscribers,
     disconnect when no subscribers are present (after grace period).
+    If the connection drops or crashes while there are still subscribers, reconnect with backoff and resume from the
+    last event received, dropping any events the stream delivers twice.
     :return:
     """
     logger.info("Starting SSE edit event relay loop...")
-    global active_subscribers, stream_active, stream_control_event
+    global stream_active, stream_control_event
 
-    while True:
-        # Wait for first subscriber before connecting
-        await stream_control_event.wait()
-        stream_control_event.clear()
+    recent_event_ids = RecentEventIds()
+    checkpoint = StreamCheckpoint(recent_event_ids)
+    checkpoint.load()
+    parse_offload.start(recent_event_ids)
+    reconnect_attempts = 0
 
-        if not active_subscribers:
-            # Event was cleared before we processed it, or all subscribers left
-            logger.debug("Stream control event cleared, no subscribers to serve.")
+    while True:
+        if not has_subscribers():
+            # Wait for first subscriber before connecting
+            await stream_control_event.wait()
+            stream_control_event.clear()
             continue
 
+        if reconnect_attempts:
+            delay = reconnect_delay(reconnect_attempts)
+            logger.info(f"Reconnecting to wiki event stream in {delay:.1f}s (attempt {reconnect_attempts})")
+            await asyncio.sleep(delay)
+
+        headers = CLIENT_HEADERS
+        resume_id = checkpoint.resume_id()
+        if resume_id:
+            logger.info(f"Resuming wiki event stream from {resume_id}")
+            headers = {**CLIENT_HEADERS, 'Last-Event-ID': resume_id}
+
         logger.info("Starting async streaming client")
-        global stream_active
         stream_active = True
+        relay_metrics.upstream_connects += 1
+        if reconnect_attempts:
+            relay_metrics.upstream_reconnects += 1
+        connected_at = None
+        deliberate = False
 
         try:
             async with AsyncClient(timeout=None) as streaming_client:
-                async with aconnect_sse(streaming_client, "GET", WIKI_EVENT_STREAM_URL, headers=CLIENT_HEADERS) as event_source:
+                async with aconnect_sse(streaming_client, "GET", WIKI_EVENT_STREAM_URL, headers=headers) as event_source:
+                    event_source.response.raise_for_status()
                     logger.info("Connected to wiki event stream")
+                    connected_at = time.monotonic()
 
                     # Create iterator once before the loop
                     sse_iterator = event_source.aiter_sse()
 
-                    # Process events while we have subscribers
-                    while active_subscribers:
-                        try:
-                            # Use asyncio.wait_for to allow checking subscriber count periodically
-                            sse_event = await asyncio.wait_for(
-                                sse_iterator.__anext__(),
-                                timeout=5.0
-                            )
-                        except asyncio.TimeoutError:
-                            # Timeout allows us to check subscriber count periodically
-                            continue
-                        except StopAsyncIteration:
-                            logger.warning("Event stream ended unexpectedly")
-                            break
-
-                        try:
-                            raw_event = json.loads(sse_event.data)
-                            # fast-filter events that aren't edits or new pages in namespace 0, or new users
-                            re_type = raw_event['type']
-                            ns = raw_event['namespace']
-                            if not ((re_type == 'edit' and ns is 0) or
-                                    (re_type == 'log' and raw_event['log_type'] == 'newusers') or
-                                    (re_type == 'new' and ns is 0)):
+                    # Process events while we have subscribers, and for a grace period after the last one leaves.
+                    # The next event is read by a task of its own, which is waited on with a timeout rather than
+                    # cancelled by one: a cancelled read closes the iterator, and so the stream.
+                    next_event = None
+                    idle_since = None
+                    try:
+                        while True:
+                            if has_subscribers():
+                                idle_since = None
+                            elif idle_since is None:
+                                idle_since = time.monotonic()
+                            elif time.monotonic() - idle_since > DISCONNECT_GRACE_PERIOD:
+                                logger.info("No subscribers left, disconnecting from wiki event stream")
+                                # a deliberate disconnect: the next connection should start from "now"
+                                checkpoint.discard()
+                                deliberate = True
+                                break
+
+                            if next_event is None:
+                                next_event = asyncio.ensure_future(sse_iterator.__anext__())
+                            # Time out to check the subscriber count periodically, and to send off a batch of events
+                            # to parse before it fills up when the stream slows down
+                            done, _ = await asyncio.wait(
+                                (next_event,), timeout=PARSE_BATCH_MAX_DELAY if parse_offload.batch else 5.0)
+                            if not done:
+                                await parse_offload.flush()
                                 continue
-                        except:
-                            continue  # if the event doesn't have parseable JSON data or a namespace, skip it.
-
-                        refined_event = refine_event(raw_event)
-                        if refined_event['event_type'] == 'unknown':
-                            continue
-
-                        for queue in list(active_subscribers):
+                            read, next_event = next_event, None
                             try:
-                                queue.put_nowait(refined_event)
-                            except Exception:
-                                pass
-
+                                sse_event = read.result()
+                            except StopAsyncIteration:
+                                logger.warning("Event stream ended unexpectedly")
+                                break
+
+                            checkpoint.update(sse_event.id)
+                            relay_metrics.events_received += 1
+
+                            if parse_offload.workers:
+                                now = time.monotonic()
+                                if parse_offload.should_offload(now):
+                                    await parse_offload.submit(sse_event.data, now)
+                                    continue
+                                if parse_offload.batch or parse_offload.pending:
+                                    await parse_offload.drain()  # events read earlier go out first
+                            relay_parsed_event(parse_raw_event(sse_event.data), recent_event_ids)
+                    finally:
+                        if next_event is not None:
+                            next_event.cancel()
+                            await asyncio.wait((next_event,))
+
+            await parse_offload.flush()
             logger.warning("Async streaming client ended stream")
 
         except asyncio.CancelledError:
             logger.info("Relay loop received and handled cancel signal.")
             stream_active = False
+            parse_offload.stop()
             raise
         except Exception as e:
             logger.exception(f"Async streaming client crashed: {e}")
+            await parse_offload.flush()
         finally:
             stream_active = False
-            logger.info("Stream disconnected, waiting for subscribers...")
+            checkpoint.save()
+            logger.info("Stream disconnected")
+
+        if deliberate:
+            reconnect_attempts = 0
+        elif connected_at is not None and time.monotonic() - connected_at >= RECONNECT_HEALTHY_SECONDS:
+            reconnect_attempts = 1  # dropped after a healthy while: back off from the start, but still reconnect
+        else:
+            reconnect_attempts += 1
 
-            # Wait for grace period or new subscriber before attempting reconnection
-            if not active_subscribers:
+
+async def handle_worker_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Serve one worker process attached to the ingest server. Refined events are written to the worker as
+    newline-delimited JSON prefixed by their sequence id, so every worker hands out the same event ids; the worker
+    writes back "1" or "0" lines to say whether it currently has subscribers, so the upstream connection is still
+    only held open while somebody is listening on some worker. The event stream metrics are written as a JSON object line on
+    attaching, and every INGEST_METRICS_INTERVAL seconds after.
+    """
+    global stream_control_event
+    worker_connections[writer] = False
+    writer.write(encode_ingest_metrics())
+    logger.info(f"Worker attached. Total workers: {len(worker_connections)}")
+    try:
+        while line := await reader.readline():
+            demand = line.strip() == b"1"
+            if demand != worker_connections[writer]:
+                worker_connections[writer] = demand
+                stream_control_event.set()
+    except ConnectionError:
+        pass
+    finally:
+        del worker_connections[writer]
+        stream_control_event.set()
+        writer.close()
+        logger.info(f"Worker detached. Remaining workers: {len(worker_connections)}")
+
+
+def encode_ingest_metrics() -> bytes:
+    return b'{"metrics":%b}\n' % json.dumps(relay_metrics.ingest_snapshot(), separators=(',', ':')).encode('utf-8')
+
+
+async def send_ingest_metrics_loop():
+    """
+    Background task for the ingest process: send the event stream metrics to every attached worker now and then,
+    so the workers' /api/metrics reports them.
+    """
+    while True:
+        await asyncio.sleep(INGEST_METRICS_INTERVAL)
+        if worker_connections:
+            line = encode_ingest_metrics()
+            for writer in worker_connections:
+                if writer.transport.get_write_buffer_size() < RELAY_WORKER_BUFFER_LIMIT:
+                    writer.write(line)
+
+
+async def run_ingest_server():
+    """
+    Run this process as the single ingest process: own the connection to the wiki event stream, parse and refine
+    events, and publish them to the worker processes that serve SSE clients.
+    """
+    logger.info(f"Starting ingest server on {RELAY_SOCKET_PATH}")
+    load_wikis_list()
+    if WIKI_LIST_REFRESH_INTERVAL:
+        asyncio.create_task(refresh_wikis_list_loop())
+    if os.path.exists(RELAY_SOCKET_PATH):
+        os.unlink(RELAY_SOCKET_PATH) # stale socket from a previous run
+    server = await asyncio.start_unix_server(handle_worker_connection, path=RELAY_SOCKET_PATH)
+    metrics_task = asyncio.create_task(send_ingest_metrics_loop())
+    # there are no event streams here for the heartbeat scheduler to look after, but its clock measures how far
+    # the event loop lags, which decides when parsing is offloaded
+    heartbeat_task = asyncio.create_task(heartbeat_scheduler.run())
+    log_summary_task = asyncio.create_task(sampled_log_summary_loop())
+    async with server:
+        try:
+            await edit_event_relay_loop()
+        finally:
+            metrics_task.cancel()
+            heartbeat_task.cancel()
+            log_summary_task.cancel()
+            flush_sampled_logs()
+
+
+async def send_worker_demand(writer: asyncio.StreamWriter):
+    """
+    Tell the ingest process whether this worker has subscribers, again every time that changes. That only decides
+    whether the ingest process stays connected to the event stream; it sends this worker every event either way.
+    """
+    global stream_control_event
+    while True:
+        writer.write(b"1\n" if subscription_registry or rate_stream_count else b"0\n")
+        await writer.drain()
+        await stream_control_event.wait()
+        stream_control_event.clear()
+
+
+async def ingest_subscriber_loop():
+    """
+    Background task for worker processes: receive refined events from the ingest process instead of connecting
+    to the wiki event stream, and fan them out to this worker's subscribers. Reconnects if the ingest process
+    goes away.
+    """
+    logger.info("Starting ingest subscriber loop...")
+    global stream_active
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(RELAY_SOCKET_PATH, limit=RELAY_WORKER_BUFFER_LIMIT)
+        except OSError as e:
+            logger.warning(f"Unable to reach ingest process at {RELAY_SOCKET_PATH}: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        logger.info("Connected to ingest process")
+        stream_active = True
+        demand_task = asyncio.create_task(send_worker_demand(writer))
+        try:
+            while line := await reader.readline():
                 try:
-                    await asyncio.wait_for(
-                        stream_control_event.wait(),
-                        timeout=DISCONNECT_GRACE_PERIOD
-                    )
-                    # New subscriber arrived within grace period, clear event and continue
-                    stream_control_event.clear()
-                except asyncio.TimeoutError:
-                    # Grace period expired, stay in waiting state
-                    logger.debug("Grace period expired, staying disconnected")
+                    if line.startswith(b"{"):
+                        relay_metrics.apply_ingest_snapshot(json_loads(line)['metrics'])
+                    else:
+                        publish_encoded_event(line.rstrip(b"\n"))
+                except Exception:
+                    event_error_log.log("Error relaying event from ingest process: %s", line, exc_info=True)
+            logger.warning("Ingest process closed the connection")
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            logger.warning(f"Lost connection to ingest process: {e}")
+        finally:
+            stream_active = False
+            demand_task.cancel()
+            writer.close()
+        await asyncio.sleep(1)
 
 
-async def filtered_event_generator(codes: list[str], types: list[str], langs: list[str]) -> AsyncGenerator[str, None]:
+def record_delivery(relayed_event: RelayedEvent) -> None:
     """
-    Each connecting client gets a separate filtered event generator.
-    :return: A generator that yields refined events as they are received from the event stream, filtered to the
-             given parameters.
+    Count an event written to a client, and how long after its upstream timestamp that happened.
+    """
+    relay_metrics.events_delivered += 1
+    timestamp = relayed_event.event.timestamp
+    if timestamp:
+        relay_metrics.delivery_lag_seconds.observe(time.time() - timestamp)
+
+
+class StreamCompressor:
+    """
+    Compresses the frames of one event stream. Every frame is flushed right away so it reaches the client without
+    delay, while the compression history carries over from frame to frame, so the repetitive event JSON compresses
+    better the longer the connection lasts.
     """
-    queue = EvictingQueue(maxsize=EVENT_QUEUE_SIZE)
-    global active_subscribers, stream_control_event
+    __slots__ = ('encoding', '_compress')
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=STREAM_COMPRESSION_BROTLI_QUALITY,
+                                           lgwin=STREAM_COMPRESSION_BROTLI_LGWIN)
+            self._compress = lambda frame: compressor.process(frame) + compressor.flush()
+        else:
+            compressor = zlib.compressobj(STREAM_COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, STREAM_COMPRESSION_GZIP_WBITS,
+                                          STREAM_COMPRESSION_GZIP_MEMLEVEL)
+            self._compress = lambda frame: compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
 
-    # Signal relay loop if this is the first subscriber
-    was_empty = len(active_subscribers) == 0
-    active_subscribers.add(queue)
+    def compress(self, frame: bytes) -> bytes:
+        return self._compress(frame)
+
+
+compressed_stream_count = 0
+
+
+def negotiate_stream_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick a content encoding for an event stream from the client's Accept-Encoding header.
+    :return: "br" or "gzip", or None to send the stream uncompressed
+    """
+    if not accept_encoding or compressed_stream_count >= STREAM_COMPRESSION_MAX_STREAMS:
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+async def compressed_event_stream(frames: AsyncGenerator[bytes, None],
+                                  compressor: StreamCompressor) -> AsyncGenerator[bytes, None]:
+    """
+    Compress an event stream frame by frame.
+    :param frames: the uncompressed event stream, closed when this one is
+    :param compressor: the compressor for this connection
+    """
+    global compressed_stream_count
+    compressed_stream_count += 1
+    try:
+        async for frame in frames:
+            yield compressor.compress(frame)
+    finally:
+        compressed_stream_count -= 1
+        await frames.aclose()
+
+
+class RateLimiter:
+    """
+    Token bucket capping the events sent to one subscriber at a steady rate, allowing bursts of up to a second's
+    worth. When more events are read than there are tokens for, new pages and new users are kept ahead of edits,
+    and the events kept are spread evenly over the ones read. The rest are skipped before any frame is encoded
+    or written for them.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def sample(self, relayed_events: list[RelayedEvent]) -> list[RelayedEvent]:
+        """
+        :param relayed_events: events read for the subscriber, oldest first
+        :return: the events to send, oldest first
+        """
+        now = time.monotonic()
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        allowed = int(tokens)
+        if len(relayed_events) <= allowed:
+            self.tokens = tokens - len(relayed_events)
+            return relayed_events
+        self.tokens = tokens - allowed
+        relay_metrics.events_rate_limited += len(relayed_events) - allowed
+        if not allowed:
+            return []
+        priority = [relayed_event for relayed_event in relayed_events
+                    if relayed_event.event.event_type in PRIORITY_EVENT_TYPES]
+        if len(priority) >= allowed:
+            return spread_sample(priority, allowed)
+        ordinary = [relayed_event for relayed_event in relayed_events
+                    if relayed_event.event.event_type not in PRIORITY_EVENT_TYPES]
+        kept = priority + spread_sample(ordinary, allowed - len(priority))
+        kept.sort(key=lambda relayed_event: relayed_event.seq)
+        return kept
+
+
+def spread_sample(relayed_events: list[RelayedEvent], count: int) -> list[RelayedEvent]:
+    """
+    :return: count of the events, evenly spaced, so a burst isn't cut down to its first few events
+    """
+    step = len(relayed_events) / count
+    return [relayed_events[int(i * step)] for i in range(count)]
+
+
+class HeartbeatScheduler:
+    """
+    One timer for the keep-alives of every event stream, instead of a timeout on every wait for events. Streams
+    note when each write to their client completes, in whole seconds of the scheduler's clock, and sit in the slot
+    of a timer wheel for the second their keep-alive would be due. Every second the scheduler looks at the streams
+    in the slot coming due: ones written to since move on to the slot of their new due time, and idle ones are woken
+    to send a keep-alive. Ones that haven't completed a write for STALLED_STREAM_TIMEOUT are unsubscribed, marked
+    reaped, and have their connection aborted: their client isn't reading, and closing the connection would wait
+    for it to read what is already buffered. The server then drops the stuck write, and the stream's generator
+    sees it was reaped and returns.
+    """
+    def __init__(self):
+        self.tick = 0 # seconds since the scheduler started
+        self.loop_lag = 0.0 # seconds the event loop was late running the last tick, a measure of how busy it is
+        self.wheel: list[set[Subscriber]] = [set() for _ in range(KEEP_ALIVE_INTERVAL + 1)]
+        self.slots: dict[Subscriber, int] = {} # stream -> wheel slot it sits in
+        self.tasks: dict[Subscriber, asyncio.Task] = {} # stream -> task writing it
+        self.transports: dict[Subscriber, asyncio.Transport] = {} # stream -> its connection, to abort if it stalls
+
+    def add(self, subscriber: Subscriber, task: asyncio.Task, transport: Optional[asyncio.Transport]) -> None:
+        """
+        :param transport: the stream's connection, or None if the server doesn't make it reachable, in which case a
+                          stalled stream's task is cancelled instead
+        """
+        subscriber.last_write = self.tick
+        self.tasks[subscriber] = task
+        if transport is not None:
+            self.transports[subscriber] = transport
+        self.schedule(subscriber, self.tick + KEEP_ALIVE_INTERVAL)
+
+    def remove(self, subscriber: Subscriber) -> None:
+        slot = self.slots.pop(subscriber, None)
+        if slot is not None:
+            self.wheel[slot].discard(subscriber)
+        self.tasks.pop(subscriber, None)
+        self.transports.pop(subscriber, None)
+
+    def schedule(self, subscriber: Subscriber, due_tick: int) -> None:
+        slot = due_tick % len(self.wheel)
+        self.slots[subscriber] = slot
+        self.wheel[slot].add(subscriber)
+
+    async def run(self):
+        """
+        Background task: advance the clock and check the streams coming due, every second.
+        """
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(1)
+            self.loop_lag = max(0.0, time.monotonic() - started - 1)
+            self.tick += 1
+            self.advance()
+
+    def advance(self) -> None:
+        tick = self.tick
+        slot = tick % len(self.wheel)
+        due, self.wheel[slot] = self.wheel[slot], set()
+        for subscriber in due:
+            idle = tick - subscriber.last_write
+            if idle >= STALLED_STREAM_TIMEOUT:
+                stream_reaped_log.log("Dropping event stream with no completed write for %ds", idle)
+                relay_metrics.streams_reaped += 1
+                task = self.tasks.get(subscriber)
+                transport = self.transports.get(subscriber)
+                self.remove(subscriber)
+                subscriber.reaped = True
+                # the generator's own cleanup won't run while its write is stuck
+                remove_subscriber(subscriber)
+                if transport is not None:
+                    transport.abort()
+                elif task is not None:
+                    task.cancel()
+            elif idle >= KEEP_ALIVE_INTERVAL:
+                subscriber.keep_alive_due = True
+                subscriber.interrupt()
+                self.schedule(subscriber, tick + KEEP_ALIVE_INTERVAL)
+            else:
+                self.schedule(subscriber, subscriber.last_write + KEEP_ALIVE_INTERVAL)
+
+
+heartbeat_scheduler = HeartbeatScheduler()
+
+
+def add_subscriber(subscriber: Subscriber, codes: Iterable[str], types: Iterable[str],
+                   language_names: Iterable[str], hashtags: Iterable[str] = ()) -> None:
+    """
+    Register a subscriber, signaling the relay loop to connect if it is the first one.
+    """
+    global stream_control_event
+    was_empty = len(subscription_registry) == 0
+    subscription_registry.subscribe(subscriber, codes, types, language_names, hashtags)
 
     if was_empty:
         logger.info("First subscriber connected, signaling relay loop to connect")
         stream_control_event.set()
     else:
-        logger.info(f"New client connected. Total subscribers: {len(active_subscribers)}")
+        client_connected_log.log("New client connected. Total subscribers: %d", len(subscription_registry))
+
+
+def remove_subscriber(subscriber: Subscriber) -> None:
+    """
+    Unregister a subscriber, signaling the relay loop if it was the last one.
+    """
+    global stream_control_event
+    if subscriber not in subscription_registry:
+        return
+    if subscriber.dropped:
+        subscriber_dropped_log.log("Subscriber fell behind and dropped %d events", subscriber.dropped)
+    subscription_registry.unsubscribe(subscriber)
+    remaining = len(subscription_registry)
+
+    if remaining == 0:
+        logger.info("Last subscriber disconnected, signaling relay loop")
+        stream_control_event.set()
+    else:
+        client_disconnected_log.log("Client disconnected. Remaining: %d", remaining)
+
+
+async def filtered_event_generator(codes: list[str], types: list[str], langs: list[str],
+                                   last_seq: Optional[int] = None,
+                                   batch_window: Optional[float] = None,
+                                   wire_format: str = 'json',
+                                   max_rate: Optional[float] = None,
+                                   hashtags: Iterable[str] = ()) -> AsyncGenerator[bytes, None]:
+    """
+    Each connecting client gets a separate filtered event generator.
+    :param last_seq: optionally, the sequence id of the last event a reconnecting client received. Buffered events
+                     it missed since then are sent first.
+    :param batch_window: optionally, seconds to collect matching events for after one arrives, to send them all
+                         together in a single "wiki_events" frame holding a JSON array.
+    :param wire_format: one of WIRE_FORMATS
+    :param max_rate: optionally, the most events per second to send. See RateLimiter.
+    :param hashtags: optionally, hashtags to narrow the other filters down to, as returned by normalize_hashtags
+    :return: A generator that yields refined events as they are received from the event stream, filtered to the
+             given parameters.
+    """
+    subscriber = Subscriber()
+    rate_limiter = RateLimiter(max_rate) if max_rate else None
+    keep_alive = MSGPACK_KEEP_ALIVE if wire_format == 'msgpack' else KEEP_ALIVE_FRAME
 
     language_names = [language_dict[lang_code]['enName'] for lang_code in langs]
+
+    add_subscriber(subscriber, codes, types, language_names, hashtags)
+    # taken right after subscribing, with no await in between, so the replay and the ring neither overlap nor gap
+    missed_events = replay_buffer.since(last_seq, set(codes), set(types), set(language_names), set(hashtags)) \
+        if last_seq is not None else []
+    if rate_limiter:
+        missed_events = rate_limiter.sample(missed_events)
+
+    heartbeat_scheduler.add(subscriber, asyncio.current_task(), request_transport())
     try:
-        while True:
-            try:
-                # Wait for a new event with timeout
-                refined_event = await asyncio.wait_for(queue.get(), timeout=15.0)
-                if await filter_pass(refined_event, codes, types, language_names):
-                    yield f"event: wiki_event\ndata: {json.dumps(refined_event)}\n\n"
-                    await asyncio.sleep(0)
-            except asyncio.TimeoutError:
+        if missed_events:
+            stream_replay_log.log("Replaying %d missed events after event %s", len(missed_events), last_seq)
+            if batch_window:
+                for i in range(0, len(missed_events), EVENT_RING_SIZE):
+                    yield encode_batch_frame(missed_events[i:i + EVENT_RING_SIZE], wire_format)
+            else:
+                for relayed_event in missed_events:
+                    yield encode_single_frame(relayed_event, wire_format)
+            subscriber.last_write = heartbeat_scheduler.tick
+            for relayed_event in missed_events:
+                record_delivery(relayed_event)
+            del missed_events
+        while not subscriber.reaped:
+            # Wait for new events, or for the heartbeat scheduler to find us idle. The registry only routes
+            # matching events to our group's ring.
+            await subscriber.wait()
+            if subscriber.reaped:
+                break
+            if batch_window and subscriber.pending():
+                # let more matching events pile up, then send everything that arrived in one frame
+                await asyncio.sleep(batch_window)
+            relayed_events = subscriber.read()
+            if rate_limiter:
+                relayed_events = rate_limiter.sample(relayed_events)
+            if relayed_events:
+                if batch_window:
+                    yield encode_batch_frame(relayed_events, wire_format)
+                else:
+                    # everything that arrived since the last write goes out in one write, each event in its own frame
+                    yield b"".join([encode_single_frame(relayed_event, wire_format)
+                                    for relayed_event in relayed_events])
+            elif subscriber.keep_alive_due:
                 # No events for a while, send keep-alive
-                yield ": keep-alive\n\n"
-                await asyncio.sleep(0)
+                yield keep_alive
+            else:
+                continue
+            # the write completed, or we wouldn't be back here
+            subscriber.last_write = heartbeat_scheduler.tick
+            subscriber.keep_alive_due = False
+            for relayed_event in relayed_events:
+                record_delivery(relayed_event)
     finally:
-        active_subscribers.remove(queue)
-        remaining = len(active_subscribers)
-
-        # Signal relay loop if this was the last subscriber
-        if remaining == 0:
-            logger.info("Last subscriber disconnected, signaling relay loop")
-            stream_control_event.set()
-        else:
-            logger.info(f"Client disconnected. Remaining: {remaining}")
+        heartbeat_scheduler.remove(subscriber)
+        remove_subscriber(subscriber)
 
 
 @app.get("/api/events/")
@@ -527,6 +2494,13 @@ async def read_events(
         wiki_codes_str: Optional[str] = Query(None, alias="codes"),
         wiki_types_str: Optional[str] = Query(None, alias="types"),
         wiki_langs_str: Optional[str] = Query(None, alias="languages"),
+        hashtags_str: Optional[str] = Query(None, alias="hashtags"),
+        last_event_id_str: Optional[str] = Query(None, alias="last_event_id"),
+        last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+        batch_ms: Optional[int] = Query(None, ge=EVENT_BATCH_MIN_MS, le=EVENT_BATCH_MAX_MS),
+        wire_format: str = Query('json', alias="format"),
+        max_rate: Optional[float] = Query(None, ge=EVENT_RATE_MIN, le=EVENT_RATE_MAX),
+        accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
 ):
     """
     Given the requested lists of desired wiki codes, types, and/or languages, return a filtered event stream
@@ -534,24 +2508,234 @@ async def read_events(
     :param wiki_codes_str: optionally, a comma separated list of wiki codes
     :param wiki_types_str: optionally, a comma separated list of wiki types
     :param wiki_langs_str: optionally, a comma separated list of wiki language codes
+    :param hashtags_str: optionally, a comma separated list of hashtags, with or without the "#", to only get events
+                         with one of them in the edit summary. Other filters narrow them down to those wikis; on
+                         their own they match any wiki.
+    :param last_event_id_str: optionally, the id of the last event received, to resume a stream after changing filters
+    :param last_event_id_header: the id of the last event received, sent by EventSource when it reconnects.
+                                 Takes precedence over the query parameter.
+    :param batch_ms: optionally, a window in milliseconds to collect events for, sending them together as a JSON
+                     array in "wiki_events" frames. Cuts per-frame overhead for busy filters.
+    :param wire_format: "json" for refined event objects, "compact" for positional arrays that use the ids from
+                        /api/wire_format, or "msgpack" for a binary stream of those arrays, each prefixed with its
+                        event id, for clients that don't use EventSource
+    :param max_rate: optionally, the most events per second to send, for clients that can't use them all. Excess
+                     events are skipped, keeping new pages and new users ahead of edits.
+    :param accept_encoding: the stream is compressed with brotli or gzip when the client accepts either
     :return: an event stream with content type "text/event-stream" containing the requested events
     """
-    logger.debug(f"Incoming event stream request with filters: {wiki_codes_str}; {wiki_types_str}; {wiki_langs_str}")
-    if not wiki_codes_str and not wiki_types_str and not wiki_langs_str:
+    stream_request_log.log("Incoming event stream request with filters: %s; %s; %s; %s",
+                           wiki_codes_str, wiki_types_str, wiki_langs_str, hashtags_str)
+    requested_hashtags = normalize_hashtags(hashtags_str.split(",")) if hashtags_str else []
+    if not wiki_codes_str and not wiki_types_str and not wiki_langs_str and not requested_hashtags:
         raise HTTPException(
             status_code=400,
-            detail="At least one filter must be specified: codes, types, or languages",
+            detail="At least one filter must be specified: codes, types, languages, or hashtags",
         )
+    if wire_format not in WIRE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format, expected one of: {', '.join(WIRE_FORMATS)}")
+    if wire_format == 'msgpack' and msgpack is None:
+        raise HTTPException(status_code=400, detail="The msgpack format is not available on this server")
 
     requested_codes = wiki_codes_str.split(",") if wiki_codes_str else []
     requested_types = wiki_types_str.split(",") if wiki_types_str else []
     requested_langs = wiki_langs_str.split(",") if wiki_langs_str else []
 
+    last_event_id = last_event_id_header or last_event_id_str
+    last_seq = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    event_stream = filtered_event_generator(requested_codes, requested_types, requested_langs, last_seq,
+                                            batch_ms / 1000 if batch_ms else None, wire_format, max_rate,
+                                            requested_hashtags)
+    headers = {'Vary': 'Accept-Encoding'}
+    encoding = negotiate_stream_encoding(accept_encoding)
+    if encoding:
+        event_stream = compressed_event_stream(event_stream, StreamCompressor(encoding))
+        headers['Content-Encoding'] = encoding
     return StreamingResponse(
-        filtered_event_generator(requested_codes, requested_types, requested_langs),
-        media_type="text/event-stream",
+        event_stream,
+        media_type="application/x-msgpack" if wire_format == 'msgpack' else "text/event-stream",
+        headers=headers,
     )
 
+
+@app.get("/api/wire_format")
+async def get_wire_format(if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+                          accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding")):
+    """
+    Get the tables for decoding the compact and msgpack event formats: the field order of an event array, and the
+    values of wiki codes, types, languages and event types in id order. Fetch them again when an event has an id
+    beyond the end of a table. Values that aren't in the tables are sent as strings rather than ids.
+    :return: JSON object with the table version, field names and value lists
+    """
+    return metadata_responses['wire_format'].response(if_none_match, accept_encoding)
+
+
+class WebSocketSubscription:
+    """
+    The filters of one WebSocket subscriber, which the client changes over the connection with messages like
+    {"action": "subscribe", "codes": ["en_wikipedia"], "languages": ["de"], "hashtags": ["wle2024"]}. Actions are
+    "subscribe" and "unsubscribe" to add or remove filter values, and "set" to replace them all. Any message may
+    also carry "batch_ms" to change the batching window, "max_rate" to change the most events per second to send,
+    and the first one "last_event_id" to resume a stream.
+    """
+    __slots__ = ('subscriber', 'codes', 'types', 'langs', 'hashtags', 'batch_window', 'rate_limiter')
+
+    def __init__(self, batch_window: Optional[float] = None):
+        self.subscriber = Subscriber()
+        self.codes: set[str] = set()
+        self.types: set[str] = set()
+        self.langs: set[str] = set()  # language codes
+        self.hashtags: set[str] = set()
+        self.batch_window = batch_window
+        self.rate_limiter: Optional[RateLimiter] = None
+
+    def language_names(self) -> list[str]:
+        return [language_dict[lang_code]['enName'] for lang_code in self.langs if lang_code in language_dict]
+
+    def apply(self, message: dict) -> None:
+        """
+        Apply a filter change message, updating the subscriber registry in place. The whole message is checked
+        before anything changes, so an invalid one leaves the subscription as it was. The subscriber only moves to
+        another subscription group, losing the events it hasn't read yet, when its filters actually change.
+        :raises ValueError: if the message isn't a valid filter change
+        """
+        action = message.get('action')
+        if action not in ('subscribe', 'unsubscribe', 'set'):
+            raise ValueError("action must be one of: subscribe, unsubscribe, set")
+        batch_window = self.batch_window
+        if 'batch_ms' in message:
+            batch_ms = message['batch_ms']
+            if batch_ms and not (isinstance(batch_ms, int) and EVENT_BATCH_MIN_MS <= batch_ms <= EVENT_BATCH_MAX_MS):
+                raise ValueError(f"batch_ms must be between {EVENT_BATCH_MIN_MS} and {EVENT_BATCH_MAX_MS}")
+            batch_window = batch_ms / 1000 if batch_ms else None
+        max_rate = self.rate_limiter.rate if self.rate_limiter else None
+        if 'max_rate' in message:
+            max_rate = message['max_rate']
+            if max_rate and not (isinstance(max_rate, (int, float)) and not isinstance(max_rate, bool)
+                                 and EVENT_RATE_MIN <= max_rate <= EVENT_RATE_MAX):
+                raise ValueError(f"max_rate must be between {EVENT_RATE_MIN} and {EVENT_RATE_MAX}")
+        filters = []
+        for current, field in ((self.codes, 'codes'), (self.types, 'types'), (self.langs, 'languages'),
+                               (self.hashtags, 'hashtags')):
+            values = message.get(field) or []
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                raise ValueError(f"{field} must be a list of strings")
+            if field == 'hashtags':
+                values = normalize_hashtags(values)
+            elif field == 'languages' and action != 'unsubscribe':
+                unknown = [value for value in values if value not in language_dict]
+                if unknown:
+                    raise ValueError(f"Unknown language codes: {', '.join(unknown)}")
+            if action == 'set':
+                filters.append(set(values))
+            elif action == 'unsubscribe':
+                filters.append(current.difference(values))
+            else:
+                filters.append(current.union(values))
+
+        self.batch_window = batch_window
+        if max_rate != (self.rate_limiter.rate if self.rate_limiter else None):
+            self.rate_limiter = RateLimiter(max_rate) if max_rate else None
+        changed = filters != [self.codes, self.types, self.langs, self.hashtags]
+        self.codes, self.types, self.langs, self.hashtags = filters
+        if self.codes or self.types or self.langs or self.hashtags:
+            if self.subscriber not in subscription_registry:
+                add_subscriber(self.subscriber, self.codes, self.types, self.language_names(), self.hashtags)
+            elif changed:
+                subscription_registry.update(self.subscriber, self.codes, self.types, self.language_names(),
+                                             self.hashtags)
+        else:
+            # nothing left to listen to, which may let the relay loop disconnect
+            remove_subscriber(self.subscriber)
+
+    def describe(self) -> dict:
+        return {'codes': sorted(self.codes), 'types': sorted(self.types), 'languages': sorted(self.langs),
+                'hashtags': sorted(self.hashtags)}
+
+
+async def send_websocket_events(websocket: WebSocket, subscription: WebSocketSubscription, wire_format: str) -> None:
+    """
+    Send the events routed to a WebSocket subscriber, until the connection goes away. Each message holds the id
+    of its last event and an array of one or more events, or, for msgpack, the events' MessagePack bytes.
+    """
+    subscriber = subscription.subscriber
+    while True:
+        await subscriber.wait()
+        if subscription.batch_window:
+            await asyncio.sleep(subscription.batch_window)
+        batch = subscriber.read()
+        if subscription.rate_limiter:
+            batch = subscription.rate_limiter.sample(batch)
+        if batch:
+            await send_websocket_batch(websocket, batch, wire_format)
+
+
+async def send_websocket_batch(websocket: WebSocket, batch: list[RelayedEvent], wire_format: str) -> None:
+    if wire_format == 'msgpack':
+        await websocket.send_bytes(encode_batch_frame(batch, wire_format))
+    else:
+        if wire_format == 'compact':
+            data = b",".join(relayed_event.compact_data() for relayed_event in batch)
+        else:
+            data = b",".join(relayed_event.data for relayed_event in batch)
+        await websocket.send_text((b'{"id":%d,"events":[%b]}' % (batch[-1].seq, data)).decode('utf-8'))
+    for relayed_event in batch:
+        record_delivery(relayed_event)
+
+
+@app.websocket("/api/subscribe")
+async def subscribe_events(websocket: WebSocket, wire_format: str = Query('json', alias="format")):
+    """
+    A persistent event subscription, whose filters the client changes with messages over the same connection
+    instead of reconnecting. See WebSocketSubscription for the messages. Every filter change is answered with
+    {"subscribed": {...}} listing the current filters, and an invalid message with {"error": "..."}.
+    :param wire_format: one of WIRE_FORMATS, as for /api/events/
+    """
+    if wire_format not in WIRE_FORMATS or (wire_format == 'msgpack' and msgpack is None):
+        await websocket.close(code=1008, reason="Unsupported format")
+        return
+    await websocket.accept()
+    subscription = WebSocketSubscription()
+    sender = None
+    try:
+        while True:
+            try:
+                received = await websocket.receive()
+                if received['type'] == 'websocket.disconnect':
+                    raise WebSocketDisconnect(received.get('code', 1000), received.get('reason'))
+                # a binary frame carries 'bytes' instead of 'text'
+                message = json_loads(received['text']) if received.get('text') is not None else None
+                if not isinstance(message, dict):
+                    raise ValueError("messages must be JSON objects")
+                subscription.apply(message)
+            except ValueError as e:  # JSON decoding errors are ValueErrors too
+                await websocket.send_json({'error': str(e)})
+                continue
+
+            missed_events = []
+            last_event_id = str(message.get('last_event_id') or '')
+            if sender is None and last_event_id.isdigit() and subscription.subscriber in subscription_registry:
+                # taken right after subscribing, with no await in between, so the replay and the ring neither
+                # overlap nor gap
+                missed_events = replay_buffer.since(int(last_event_id), subscription.codes, subscription.types,
+                                                    set(subscription.language_names()), subscription.hashtags)
+                if subscription.rate_limiter:
+                    missed_events = subscription.rate_limiter.sample(missed_events)
+            await websocket.send_json({'subscribed': subscription.describe()})
+            if sender is None:
+                # the sender starts after any replay, so missed events go out ahead of new ones
+                for i in range(0, len(missed_events), EVENT_RING_SIZE):
+                    await send_websocket_batch(websocket, missed_events[i:i + EVENT_RING_SIZE], wire_format)
+                sender = asyncio.create_task(send_websocket_events(websocket, subscription, wire_format))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if sender:
+            sender.cancel()
+        remove_subscriber(subscription.subscriber)
+
+
 @app.get("/api/health_check")
 async def run_health_check():
     """
@@ -568,20 +2752,125 @@ async def get_stream_status():
     Get the current status of the wiki event stream connection.
     :return: JSON object with stream connection status and subscriber count.
     """
-    global stream_active, active_subscribers
+    global stream_active
     return {
         "stream_connected": stream_active,
-        "active_subscribers": len(active_subscribers),
+        "active_subscribers": len(subscription_registry),
     }
 
 
+@app.get("/api/rates")
+async def get_rates():
+    """
+    Get the recent activity of every wiki, wiki type and language, whether or not anyone is subscribed to it.
+    :return: JSON object with the window in seconds, and the events per minute over that window by wiki code, by
+             wiki type and by language enName, which is what language filters match on. Only wikis, types and
+             languages with recent events are listed.
+    """
+    return Response(rate_counters.snapshot(), media_type="application/json",
+                    headers={'Cache-Control': RATES_CACHE_CONTROL})
+
+
+async def rates_event_generator(interval: int) -> AsyncGenerator[bytes, None]:
+    """
+    Send the /api/rates snapshot as a "wiki_rates" event every interval seconds, keeping the relay connected to the
+    wiki event stream while the client listens.
+    """
+    global rate_stream_count, stream_control_event
+    rate_stream_count += 1
+    stream_control_event.set()
+    try:
+        while True:
+            yield b"event: wiki_rates\ndata: %b\n\n" % rate_counters.snapshot()
+            await asyncio.sleep(interval)
+    finally:
+        rate_stream_count -= 1
+        stream_control_event.set()
+
+
+@app.get("/api/rates/stream")
+async def read_rates(interval: int = Query(RATE_STREAM_MIN_INTERVAL, ge=RATE_STREAM_MIN_INTERVAL,
+                                           le=RATE_STREAM_MAX_INTERVAL)):
+    """
+    Stream the recent activity of every wiki, wiki type and language, as returned by /api/rates.
+    :param interval: seconds between updates
+    :return: an event stream with content type "text/event-stream" of "wiki_rates" events
+    """
+    return StreamingResponse(rates_event_generator(interval), media_type="text/event-stream")
+
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 5, 10, 25, 50, 75, 100, EVENT_RING_SIZE - 1)
+EVICTION_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """
+    Metrics for the relay, in the Prometheus text exposition format.
+    :return: a text/plain response with counters, gauges and histograms
+    """
+    m = relay_metrics
+    lines = []
+    for name, value, help_text in (
+            ("l2wc_events_received_total", m.events_received, "Events received from the wiki event stream"),
+            ("l2wc_events_prefiltered_total", m.events_prefiltered, "Events rejected from the raw data before parsing"),
+            ("l2wc_events_filtered_total", m.events_filtered, "Events rejected after parsing, or unparseable"),
+            ("l2wc_events_duplicate_total", m.events_duplicate, "Events dropped as redelivered after resuming"),
+            ("l2wc_events_refined_total", m.events_refined, "Events refined and published to subscribers"),
+            ("l2wc_events_offloaded_total", m.events_offloaded,
+             "Events parsed and refined on the parse worker pool instead of the event loop"),
+            ("l2wc_events_delivered_total", m.events_delivered, "Event frames written to clients"),
+            ("l2wc_events_evicted_total", m.events_evicted, "Events skipped by subscribers that fell behind"),
+            ("l2wc_events_rate_limited_total", m.events_rate_limited,
+             "Events skipped for subscribers over their requested max_rate"),
+            ("l2wc_streams_reaped_total", m.streams_reaped, "Event streams dropped after their writes stalled"),
+            ("l2wc_upstream_connects_total", m.upstream_connects, "Connections made to the wiki event stream"),
+            ("l2wc_upstream_reconnects_total", m.upstream_reconnects,
+             "Connections to the wiki event stream made after a dropped or failed connection"),
+            ("l2wc_log_messages_sampled_total", m.log_messages_sampled,
+             "Repetitive log messages left out of the log and counted in a periodic summary"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+
+    for name, value, help_text in (
+            ("l2wc_stream_connected", int(stream_active), "Whether the upstream event source is connected"),
+            ("l2wc_active_subscribers", len(subscription_registry), "Connected subscribers"),
+            ("l2wc_subscription_groups", subscription_registry.group_count(), "Distinct subscriber filter sets"),
+            ("l2wc_replay_buffer_events", len(replay_buffer), "Events held for resuming clients"),
+            ("l2wc_attached_workers", len(worker_connections), "Worker processes attached to this ingest process"),
+            ("l2wc_compressed_streams", compressed_stream_count, "Connected subscribers with compressed streams"),
+            ("l2wc_parse_offload_active", int(parse_offload.active), "Whether events are parsed on the worker pool"),
+            ("l2wc_event_loop_lag_seconds", round(heartbeat_scheduler.loop_lag, 6),
+             "How late the event loop last ran a one second timer"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+    # per-subscriber distributions, computed when scraped rather than on the hot path
+    queue_depths = Histogram(QUEUE_DEPTH_BUCKETS)
+    evictions = Histogram(EVICTION_BUCKETS)
+    for subscriber in subscription_registry:
+        queue_depths.observe(subscriber.pending())
+        evictions.observe(subscriber.dropped)
+    lines += queue_depths.exposition("l2wc_subscriber_queue_depth", "Events waiting to be read by each subscriber")
+    lines += evictions.exposition("l2wc_subscriber_evictions", "Events each subscriber skipped after falling behind")
+    lines += m.parse_refine_seconds.exposition("l2wc_parse_refine_seconds", "Time to parse and refine an event")
+    lines += m.delivery_lag_seconds.exposition("l2wc_delivery_lag_seconds",
+                                               "Time from the upstream event timestamp to delivery to a client")
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
 def main():
     """
-    If for some reason someone tries to run this module directly, tell them what to do
+    Run the ingest server when asked to with "ingest". Otherwise, if for some reason someone tries to run this
+    module directly, tell them what to do
     """
+    if sys.argv[1:] == ["ingest"]:
+        asyncio.run(run_ingest_server())
+        return
     print("Run in dev with: uv run -- fastapi dev main.py\n"
           "Run in prod with: source .venv/bin/activate; python -m fastapi run main.py\n"
-          "Or, alternatively: uvicorn l2wc_api.main:app --host 0.0.0.0 --port 8000"
+          "Or, alternatively: uvicorn l2wc_api.main:app --host 0.0.0.0 --port 8000 --timeout-graceful-shutdown 5\n"
+          "Run the ingest process for multiple workers with: python -m l2wc_api.main ingest"
           )
 
 
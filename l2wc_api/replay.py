@@ -0,0 +1,203 @@
+"""
+Record the wiki event stream to a file, and replay a recording from a local stand-in for the event stream, so the
+relay can be load tested and profiled without hitting stream.wikimedia.org.
+
+Record a few minutes of recent changes:
+
+    python -m l2wc_api.replay record recording.jsonl.gz --duration 300
+
+Replay it at ten times the recorded rate, and point the API at it:
+
+    python -m l2wc_api.replay serve recording.jsonl.gz --speed 10 --port 8001
+    L2WC_EVENT_STREAM_URL=http://127.0.0.1:8001/v2/stream/recentchange fastapi dev l2wc_api/main.py
+
+The replay server also stands in for the wikistats wiki list, serving the local wikimedias.csv, for testing wiki
+list refreshes with L2WC_WIKI_LIST_URL=http://127.0.0.1:8001/wikimedias_csv.php
+
+Recordings are gzip compressed JSON lines, one per SSE event, holding the seconds since the recording started,
+the SSE event id and the raw SSE data.
+"""
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import re
+import sys
+import time
+
+from logging import Logger, StreamHandler, Formatter
+from typing import AsyncGenerator, Iterator, NamedTuple, Optional
+
+from httpx import AsyncClient
+from httpx_sse import aconnect_sse
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import FileResponse, StreamingResponse
+from starlette.routing import Route
+
+DEFAULT_STREAM_URL = "https://stream.wikimedia.org/v2/stream/recentchange"
+CLIENT_HEADERS = {'User-Agent': 'listen-to-wiki-changes/0.0 (https://listen-to-wiki-changes.toolforge.org/; ttaylor@wikimedia.org)'}
+STREAM_PATH = "/v2/stream/recentchange"
+WIKI_LIST_PATH = "/wikimedias_csv.php"
+TIMESTAMP_PATTERN = re.compile(r'"timestamp"\s*:\s*[0-9.]+')
+EVENT_UUID_PATTERN = re.compile(r'"id"\s*:\s*"') # meta.id is the only id with a string value
+
+logger: Logger = Logger(__name__)
+logger.setLevel("INFO")
+stream_handler = StreamHandler(sys.stdout)
+stream_handler.setFormatter(Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+logger.addHandler(stream_handler)
+
+
+class RecordedEvent(NamedTuple):
+    """
+    One SSE event from a recording.
+    """
+    offset: float # seconds since the recording started
+    id: Optional[str]
+    data: str
+
+
+def read_recording(path: str) -> Iterator[RecordedEvent]:
+    """
+    Read the events of a recording, in order.
+    :param path: the recording file, gzip compressed if it ends in .gz
+    :return: an iterator over the recorded events
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                recorded = json.loads(line)
+                yield RecordedEvent(recorded['t'], recorded.get('id'), recorded['data'])
+
+
+async def record(url: str, path: str, duration: Optional[float], count: Optional[int]) -> None:
+    """
+    Record the raw SSE events of an event stream to a file until the duration or count is reached, or until
+    interrupted.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    recorded = 0
+    with opener(path, 'wt', encoding='utf-8') as f:
+        async with AsyncClient(timeout=None) as client:
+            async with aconnect_sse(client, "GET", url, headers=CLIENT_HEADERS) as event_source:
+                event_source.response.raise_for_status()
+                logger.info(f"Recording {url} to {path}")
+                started = time.monotonic()
+                try:
+                    async for sse_event in event_source.aiter_sse():
+                        offset = time.monotonic() - started
+                        f.write(json.dumps({'t': round(offset, 3), 'id': sse_event.id or None, 'data': sse_event.data},
+                                           separators=(',', ':')) + "\n")
+                        recorded += 1
+                        if recorded % 1000 == 0:
+                            logger.info(f"Recorded {recorded} events in {offset:.0f}s")
+                        if (duration and offset >= duration) or (count and recorded >= count):
+                            break
+                except asyncio.CancelledError:
+                    pass
+    logger.info(f"Finished recording {recorded} events to {path}")
+
+
+def create_replay_app(path: str, speed: Optional[float], loop: bool = False, restamp: bool = False,
+                      wiki_list_path: str = "wikimedias.csv") -> Starlette:
+    """
+    Create a stand-in for the wiki event stream that replays a recording to every client that connects.
+    :param path: the recording file
+    :param speed: multiple of the recorded rate to replay at, or None to replay as fast as possible
+    :param loop: start over from the beginning when the recording runs out. Event uuids are changed on every pass
+                 after the first, so the relay doesn't drop them as duplicates.
+    :param restamp: replace each event's timestamp with the time it is sent, so delivery latency can be measured
+    :param wiki_list_path: the wiki list file to serve in place of the wikistats one
+    :return: the ASGI app
+    """
+    events = list(read_recording(path))
+    logger.info(f"Loaded {len(events)} events from {path}")
+
+    async def replay_events(start: int) -> AsyncGenerator[bytes, None]:
+        for replay_pass in itertools.count():
+            started = time.monotonic()
+            first_offset = events[start].offset if start < len(events) else 0.0
+            for i, event in enumerate(events[start:]):
+                if speed:
+                    delay = started + (event.offset - first_offset) / speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif i % 100 == 0:
+                    await asyncio.sleep(0) # as fast as possible, but let other clients have a turn
+                event_id = f"id: {event.id}\n" if event.id else ""
+                data = event.data
+                if replay_pass:
+                    data = EVENT_UUID_PATTERN.sub(f'"id":"{replay_pass}-', data, count=1)
+                if restamp:
+                    data = TIMESTAMP_PATTERN.sub(f'"timestamp":{time.time():.6f}', data, count=1)
+                yield f"event: message\n{event_id}data: {data}\n\n".encode('utf-8')
+            if not loop:
+                return
+            start = 0
+
+    async def stream(request: Request) -> StreamingResponse:
+        # resume after the given event, as the real event stream does
+        start = 0
+        last_event_id = request.headers.get('last-event-id')
+        if last_event_id:
+            start = next((i + 1 for i, event in enumerate(events) if event.id == last_event_id), 0)
+        logger.info(f"Client connected, replaying from event {start}")
+        return StreamingResponse(replay_events(start), media_type="text/event-stream")
+
+    async def wiki_list(request: Request) -> FileResponse:
+        return FileResponse(wiki_list_path, media_type="text/csv")
+
+    return Starlette(routes=[Route(STREAM_PATH, stream), Route(WIKI_LIST_PATH, wiki_list)])
+
+
+def parse_speed(value: str) -> Optional[float]:
+    """
+    :return: the replay speed multiple, or None for "max"
+    """
+    if value == "max":
+        return None
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive, or max")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m l2wc_api.replay", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record the wiki event stream to a file")
+    record_parser.add_argument("path", help="recording file to write, gzip compressed if it ends in .gz")
+    record_parser.add_argument("--url", default=DEFAULT_STREAM_URL, help="event stream to record")
+    record_parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    record_parser.add_argument("--count", type=int, help="stop after this many events")
+
+    serve_parser = commands.add_parser("serve", help="replay a recording as a local event stream")
+    serve_parser.add_argument("path", help="recording file to replay")
+    serve_parser.add_argument("--speed", type=parse_speed, default=1.0,
+                              help="multiple of the recorded rate, e.g. 1, 10 or 100, or max for as fast as possible")
+    serve_parser.add_argument("--loop", action="store_true", help="start over when the recording runs out")
+    serve_parser.add_argument("--restamp", action="store_true",
+                              help="replace event timestamps with the time they are sent, to measure latency")
+    serve_parser.add_argument("--wiki-list", default="wikimedias.csv", help="wiki list file to serve")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8001)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        try:
+            asyncio.run(record(args.url, args.path, args.duration, args.count))
+        except KeyboardInterrupt:
+            pass
+    else:
+        import uvicorn
+        app = create_replay_app(args.path, args.speed, args.loop, args.restamp, args.wiki_list)
+        logger.info(f"Replaying at http://{args.host}:{args.port}{STREAM_PATH}")
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
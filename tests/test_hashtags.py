@@ -0,0 +1,48 @@
+"""
+Tests for finding hashtags in edit summaries, and matching requested hashtags against them.
+"""
+import json
+import os
+
+import pytest
+
+from l2wc_api import main as relay
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.mark.parametrize("comment, hashtags", [
+    ("#WLE2024 upload", ("wle2024",)),
+    ("Uploaded for #wikiLovesEarth and #WLE2024", ("wikilovesearth", "wle2024")),
+    ("#Foo and #foo again, #FOO", ("foo",)),
+    ("see [[Page#Section]] and issue #1", ()),
+    ("tags:#nospace", ()),
+    ("#édition_2024 #1lib1ref (#notatag)", ("édition_2024", "1lib1ref")),
+    ("no hashtags here", ()),
+    ("", ()),
+    (None, ()),
+])
+def test_extract_hashtags(comment, hashtags):
+    assert relay.extract_hashtags(comment) == hashtags
+
+
+def test_normalize_hashtags():
+    assert relay.normalize_hashtags(["#WLE2024", " 1Lib1Ref ", "#", ""]) == ["wle2024", "1lib1ref"]
+
+
+def test_refined_events_carry_the_hashtags_of_their_summary():
+    with open(os.path.join(DATA_DIR, "recentchange.jsonl"), "r", encoding="utf-8") as f:
+        raw_event = json.loads(f.readline())
+    raw_event['comment'] = "/* Early life */ copyedit #1Lib1Ref"
+    assert relay.refine_event(raw_event).hashtags == ("1lib1ref",)
+    raw_event['comment'] = "/* Early life */ copyedit"
+    assert relay.refine_event(raw_event).hashtags == ()
+
+
+def test_filter_pass_with_hashtags():
+    event = relay.RefinedEvent(1, "en.wikipedia.org", "wikipedia", "edit", "en_wikipedia", "English", "Title",
+                               "url", 0, "user", False, 10, ("wle2024",))
+    assert relay.filter_pass(event, set(), set(), set(), {"wle2024"})
+    assert relay.filter_pass(event, set(), {"wikipedia"}, set(), {"wle2024", "other"})
+    assert not relay.filter_pass(event, set(), {"wiktionary"}, set(), {"wle2024"})
+    assert not relay.filter_pass(event, {"en_wikipedia"}, set(), set(), {"other"})
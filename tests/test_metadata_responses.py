@@ -0,0 +1,23 @@
+"""
+Tests for the pre-encoded metadata responses and their conditional requests.
+"""
+from l2wc_api import main as relay
+
+
+def test_not_modified_for_the_negotiated_encoding():
+    response = relay.PreEncodedResponse({"wikis": {"en_wikipedia": {"code": "en_wikipedia"}}})
+    etag = response.etags['gzip']
+    assert response.response(etag, "gzip").status_code == 304
+
+
+def test_etag_of_another_encoding_gets_the_full_response():
+    response = relay.PreEncodedResponse({"wikis": {"en_wikipedia": {"code": "en_wikipedia"}}})
+    full = response.response(response.etags['gzip'], None)
+    assert full.status_code == 200
+    assert full.body == response.bodies['identity']
+    assert full.headers['ETag'] == response.etags['identity']
+
+
+def test_any_etag_matches_a_wildcard():
+    response = relay.PreEncodedResponse([])
+    assert response.response("*", "br, gzip").status_code == 304
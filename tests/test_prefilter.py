@@ -0,0 +1,62 @@
+"""
+Tests for rejecting raw events before they are parsed, against recentchange payloads in tests/data:
+recentchange.jsonl has events of each kind the event stream sends, as it sends them, and
+recentchange_unusual.jsonl has payloads shaped to trip up a scan of the raw text.
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+import json
+import os
+
+import pytest
+
+from l2wc_api import main as relay
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+def read_payloads(name: str) -> list[str]:
+    with open(os.path.join(DATA_DIR, name), "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+PAYLOADS = read_payloads("recentchange.jsonl")
+UNUSUAL_PAYLOADS = read_payloads("recentchange_unusual.jsonl")
+
+
+def accepted(data: str) -> bool:
+    """
+    The full-parse filter, with the standard library decoder.
+    """
+    try:
+        return relay.accept_raw_event(json.loads(data))
+    except (ValueError, KeyError):
+        return False
+
+
+@pytest.mark.parametrize("data", PAYLOADS)
+def test_prefilter_matches_full_parse(data):
+    assert relay.prefilter_raw_event(data) == accepted(data)
+
+
+@pytest.mark.parametrize("data", PAYLOADS + UNUSUAL_PAYLOADS)
+def test_prefilter_never_rejects_accepted_events(data):
+    assert relay.prefilter_raw_event(data) or not accepted(data)
+
+
+def test_prefilter_rejects_irrelevant_events():
+    rejected = [json.loads(data) for data in PAYLOADS if not relay.prefilter_raw_event(data)]
+    assert {(event['type'], event['namespace']) for event in rejected} >= {
+        ('edit', 1), ('new', 2), ('categorize', 14), ('external', 0), ('log', 2), ('log', 0)}
+
+
+@pytest.mark.parametrize("prefilter", [True, False])
+@pytest.mark.parametrize("data", PAYLOADS + UNUSUAL_PAYLOADS)
+def test_parse_raw_event_relays_accepted_events(monkeypatch, prefilter, data):
+    monkeypatch.setattr(relay, "PREFILTER_RAW_EVENTS", prefilter)
+    parsed = relay.parse_raw_event(data)
+    assert (parsed.outcome == 'refined') == accepted(data)
+    if parsed.outcome == 'prefiltered':
+        assert prefilter
@@ -0,0 +1,107 @@
+"""
+Tests for capping the events sent to a subscriber, and for the sliding-window event rates.
+"""
+import json
+
+import pytest
+
+from l2wc_api import main as relay
+
+
+def relayed(seq: int, event_type: str = "edit", code: str = "en_wikipedia") -> relay.RelayedEvent:
+    event = relay.RefinedEvent(seq, "example.org", "wikipedia", event_type, code, "English", "Title", "url", 0,
+                               "user", False, 10)
+    return relay.RelayedEvent(seq, event, b"", b"")
+
+
+def seqs(relayed_events) -> list[int]:
+    return [relayed_event.seq for relayed_event in relayed_events]
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(relay.time, "monotonic", clock)
+    monkeypatch.setattr(relay, "relay_metrics", relay.RelayMetrics())
+    return clock
+
+
+def test_spread_sample_keeps_evenly_spaced_events():
+    events = [relayed(seq) for seq in range(10)]
+    assert seqs(relay.spread_sample(events, 5)) == [0, 2, 4, 6, 8]
+    assert seqs(relay.spread_sample(events, 3)) == [0, 3, 6]
+    assert seqs(relay.spread_sample(events, 10)) == list(range(10))
+
+
+def test_events_under_the_rate_all_go_out(clock):
+    limiter = relay.RateLimiter(5)
+    events = [relayed(seq) for seq in range(5)]
+    assert limiter.sample(events) is events
+    assert relay.relay_metrics.events_rate_limited == 0
+
+
+def test_a_burst_is_sampled_down_to_the_tokens_available(clock):
+    limiter = relay.RateLimiter(5)
+    assert seqs(limiter.sample([relayed(seq) for seq in range(20)])) == [0, 4, 8, 12, 16]
+    assert relay.relay_metrics.events_rate_limited == 15
+    # no time has passed, so there are no tokens left
+    assert limiter.sample([relayed(20)]) == []
+    clock.now += 1
+    assert len(limiter.sample([relayed(seq) for seq in range(21, 41)])) == 5
+    assert relay.relay_metrics.events_rate_limited == 31
+
+
+def test_new_pages_and_users_are_kept_ahead_of_edits(clock):
+    limiter = relay.RateLimiter(5)
+    events = [relayed(seq, "new_page" if seq in (3, 17) else "edit") for seq in range(20)]
+    kept = limiter.sample(events)
+    assert seqs(kept) == sorted(seqs(kept))
+    assert {3, 17} <= set(seqs(kept))
+    assert len(kept) == 5
+
+
+def test_priority_events_alone_are_spread_when_over_the_rate(clock):
+    limiter = relay.RateLimiter(3)
+    events = [relayed(seq, "new_user" if seq % 2 else "edit") for seq in range(20)]
+    assert seqs(limiter.sample(events)) == [1, 7, 13]
+
+
+def test_rate_wheel_drops_buckets_that_fall_out_of_the_window():
+    wheel = relay.RateWheel(100, "wikipedia", "English")
+    for tick, count in ((100, 3), (101, 4), (110, 5)):
+        wheel.advance(tick)
+        wheel.buckets[tick % relay.RATE_BUCKETS] += count
+        wheel.total += count
+    wheel.advance(100 + relay.RATE_BUCKETS)
+    assert wheel.total == 9
+    wheel.advance(101 + relay.RATE_BUCKETS)
+    assert wheel.total == 5
+    wheel.advance(110 + 3 * relay.RATE_BUCKETS)
+    assert wheel.total == 0
+    assert sum(wheel.buckets) == 0
+
+
+def test_rates_are_summed_per_wiki_type_and_language(clock):
+    counters = relay.RateCounters()
+    now = clock.now
+    for _ in range(30):
+        counters.count(relayed(1).event, now)
+        counters.count(relayed(2, code="simple_wikipedia").event, now + 30)
+    clock.now = now + 31
+    rates = json.loads(counters.snapshot())
+    scale = 60 / relay.RATE_WINDOW_SECONDS
+    assert rates['codes'] == {'en_wikipedia': 30 * scale, 'simple_wikipedia': 30 * scale}
+    assert rates['types'] == {'wikipedia': 60 * scale}
+    assert rates['languages'] == {'English': 60 * scale}
+    clock.now = now + relay.RATE_WINDOW_SECONDS + 1
+    assert json.loads(counters.snapshot())['codes'] == {'simple_wikipedia': 30 * scale}
+    # wikis without events in the window are forgotten
+    assert list(counters.wheels) == ['simple_wikipedia']
@@ -0,0 +1,62 @@
+"""
+Tests for dropping event streams whose clients stopped reading, against the app served by uvicorn.
+"""
+import asyncio
+import socket
+
+import uvicorn
+
+from l2wc_api import main as relay
+
+
+def make_event(i: int) -> relay.RefinedEvent:
+    # long titles, so the socket buffers fill after a few hundred events
+    return relay.RefinedEvent(i, "en.wikipedia.org", "wikipedia", "edit", "en_wikipedia", "English", "x" * 4000,
+                              "https://en.wikipedia.org/wiki/X", 0, "user", False, 10)
+
+
+async def serve_stalled_client() -> dict:
+    config = uvicorn.Config(relay.app, host="127.0.0.1", port=0, lifespan="off", log_level="warning")
+    server = uvicorn.Server(config)
+    serving = asyncio.create_task(server.serve())
+    heartbeat = asyncio.create_task(relay.heartbeat_scheduler.run())
+    client = socket.socket()
+    try:
+        while not server.started:
+            await asyncio.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        client.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(client, ("127.0.0.1", port))
+        client.sendall(b"GET /api/events/?types=wikipedia HTTP/1.1\r\nHost: test\r\n\r\n")
+        # the client never reads, while events keep coming
+        for i in range(2000):
+            relay.publish_refined_event(make_event(i))
+            await asyncio.sleep(0.005)
+            if relay.relay_metrics.streams_reaped:
+                break
+        for _ in range(40):
+            if not server.server_state.connections:
+                break
+            await asyncio.sleep(0.05)
+        return {
+            'reaped': relay.relay_metrics.streams_reaped,
+            'connections': len(server.server_state.connections),
+            'tasks': len(server.server_state.tasks),
+            'subscribers': len(relay.subscription_registry),
+        }
+    finally:
+        client.close()
+        heartbeat.cancel()
+        server.should_exit = True
+        await serving
+
+
+def test_stalled_client_is_released(monkeypatch):
+    monkeypatch.setattr(relay, "KEEP_ALIVE_INTERVAL", 1)
+    monkeypatch.setattr(relay, "STALLED_STREAM_TIMEOUT", 2)
+    monkeypatch.setattr(relay, "heartbeat_scheduler", relay.HeartbeatScheduler())
+    monkeypatch.setattr(relay, "relay_metrics", relay.RelayMetrics())
+    monkeypatch.setattr(relay, "replay_buffer", relay.ReplayBuffer())
+    result = asyncio.run(serve_stalled_client())
+    assert result == {'reaped': 1, 'connections': 0, 'tasks': 0, 'subscribers': 0}
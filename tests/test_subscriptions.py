@@ -0,0 +1,117 @@
+"""
+Tests for routing events to subscription groups, and for reading them through a group's ring.
+"""
+import pytest
+
+from l2wc_api import main as relay
+
+RING = relay.EVENT_RING_SIZE
+
+
+def relayed(seq: int, code: str = "en_wikipedia", wiki_type: str = "wikipedia", language: str = "English",
+            hashtags: tuple = ()) -> relay.RelayedEvent:
+    event = relay.RefinedEvent(seq, "example.org", wiki_type, "edit", code, language, "Title", "url", 0, "user",
+                               False, 10, hashtags)
+    return relay.RelayedEvent(seq, event, b"", b"")
+
+
+def seqs(relayed_events) -> list[int]:
+    return [relayed_event.seq for relayed_event in relayed_events]
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(relay, "relay_metrics", relay.RelayMetrics())
+    return relay.SubscriptionRegistry()
+
+
+def subscribe(registry, codes=(), types=(), languages=(), hashtags=()) -> relay.Subscriber:
+    subscriber = relay.Subscriber()
+    registry.subscribe(subscriber, codes, types, languages, hashtags)
+    return subscriber
+
+
+def test_reads_events_published_after_subscribing(registry):
+    registry.publish(relayed(1))
+    subscriber = subscribe(registry, types=["wikipedia"])
+    for seq in (2, 3, 4):
+        registry.publish(relayed(seq))
+    assert subscriber.pending() == 3
+    assert seqs(subscriber.read()) == [2, 3, 4]
+    assert subscriber.read() == []
+
+
+def test_same_filters_share_one_group(registry):
+    first = subscribe(registry, codes=["en_wikipedia"], languages=["English"])
+    second = subscribe(registry, codes=["en_wikipedia"], languages=["English"])
+    other = subscribe(registry, codes=["en_wikipedia"])
+    assert first.group is second.group
+    assert other.group is not first.group
+    assert registry.group_count() == 2
+    registry.publish(relayed(1))
+    assert seqs(first.read()) == seqs(second.read()) == seqs(other.read()) == [1]
+
+
+def test_events_are_routed_by_code_type_and_language(registry):
+    by_code = subscribe(registry, codes=["de_wikipedia"])
+    by_type = subscribe(registry, types=["wiktionary"])
+    by_language = subscribe(registry, languages=["German"])
+    registry.publish(relayed(1, code="de_wikipedia", language="German"))
+    registry.publish(relayed(2, code="de_wiktionary", wiki_type="wiktionary", language="German"))
+    registry.publish(relayed(3))
+    assert seqs(by_code.read()) == [1]
+    assert seqs(by_type.read()) == [2]
+    assert seqs(by_language.read()) == [1, 2]
+
+
+def test_ring_overrun_fast_forwards_to_the_oldest_event_held(registry):
+    subscriber = subscribe(registry, types=["wikipedia"])
+    for seq in range(RING + 10):
+        registry.publish(relayed(seq))
+    assert subscriber.pending() == RING
+    assert seqs(subscriber.read()) == list(range(10, RING + 10))
+    assert subscriber.dropped == 10
+    assert relay.relay_metrics.events_evicted == 10
+
+
+def test_lapped_subscriber_counts_every_skipped_event(registry):
+    fast = subscribe(registry, types=["wikipedia"])
+    slow = subscribe(registry, types=["wikipedia"])
+    for seq in range(50):
+        registry.publish(relayed(seq))
+    assert len(slow.read()) == 50
+    # lapped more than twice over while the fast subscriber keeps up
+    for seq in range(50, 50 + 2 * RING + 5):
+        registry.publish(relayed(seq))
+        fast.read()
+    assert seqs(slow.read()) == list(range(50 + RING + 5, 50 + 2 * RING + 5))
+    assert slow.dropped == RING + 5
+    assert fast.dropped == 0
+
+
+def test_hashtag_only_group_matches_any_wiki_with_the_hashtag(registry):
+    subscriber = subscribe(registry, hashtags=["wle2024"])
+    registry.publish(relayed(1, hashtags=("wle2024",)))
+    registry.publish(relayed(2, code="commons", wiki_type="special", language="multi", hashtags=("other", "wle2024")))
+    registry.publish(relayed(3))
+    registry.publish(relayed(4, hashtags=("other",)))
+    assert seqs(subscriber.read()) == [1, 2]
+
+
+def test_hashtags_narrow_down_the_other_filters(registry):
+    subscriber = subscribe(registry, codes=["commons"], hashtags=["wle2024"])
+    registry.publish(relayed(1, hashtags=("wle2024",)))
+    registry.publish(relayed(2, code="commons", wiki_type="special", language="multi", hashtags=("wle2024",)))
+    registry.publish(relayed(3, code="commons", wiki_type="special", language="multi"))
+    assert seqs(subscriber.read()) == [2]
+
+
+def test_last_unsubscribe_drops_the_group_from_the_indexes(registry):
+    subscriber = subscribe(registry, hashtags=["wle2024"])
+    other = subscribe(registry, codes=["en_wikipedia"])
+    registry.unsubscribe(subscriber)
+    registry.unsubscribe(other)
+    assert subscriber.group is None
+    assert registry.group_count() == 0
+    registry.publish(relayed(1, hashtags=("wle2024",)))
+    assert subscriber.read() == []
@@ -0,0 +1,64 @@
+"""
+Tests for WebSocket subscriptions and the filter change messages they take.
+"""
+import pytest
+from starlette.testclient import TestClient
+
+from l2wc_api import main as relay
+
+LANGUAGES = {
+    'de': {'langCode': 'de', 'enName': 'German'},
+    'en': {'langCode': 'en', 'enName': 'English'},
+}
+
+
+@pytest.fixture
+def subscription(monkeypatch):
+    monkeypatch.setattr(relay, "language_dict", LANGUAGES)
+    subscription = relay.WebSocketSubscription()
+    yield subscription
+    relay.remove_subscriber(subscription.subscriber)
+
+
+def test_subscribe_adds_filters(subscription):
+    subscription.apply({'action': 'subscribe', 'codes': ['en_wikipedia'], 'languages': ['de'], 'batch_ms': 100})
+    assert subscription.describe() == {'codes': ['en_wikipedia'], 'types': [], 'languages': ['de'], 'hashtags': []}
+    assert subscription.batch_window == 0.1
+    assert subscription.subscriber in relay.subscription_registry
+
+
+@pytest.mark.parametrize("message", [
+    {'action': 'subscribe', 'codes': ['de_wikipedia'], 'languages': ['xx']},
+    {'action': 'subscribe', 'codes': ['de_wikipedia'], 'batch_ms': 5},
+    {'action': 'subscribe', 'codes': ['de_wikipedia'], 'max_rate': 10, 'types': 'wikipedia'},
+    {'action': 'set', 'codes': ['de_wikipedia'], 'max_rate': -1},
+])
+def test_invalid_message_changes_nothing(subscription, message):
+    subscription.apply({'action': 'subscribe', 'codes': ['en_wikipedia'], 'languages': ['en'], 'max_rate': 5})
+    group = subscription.subscriber.group
+    rate_limiter = subscription.rate_limiter
+    with pytest.raises(ValueError):
+        subscription.apply(message)
+    assert subscription.describe() == {'codes': ['en_wikipedia'], 'types': [], 'languages': ['en'], 'hashtags': []}
+    assert subscription.batch_window is None
+    assert subscription.rate_limiter is rate_limiter
+    assert subscription.subscriber.group is group
+
+
+def test_unchanged_filters_keep_the_group(subscription):
+    subscription.apply({'action': 'subscribe', 'types': ['wikipedia']})
+    group = subscription.subscriber.group
+    subscription.apply({'action': 'subscribe', 'types': ['wikipedia'], 'batch_ms': 200})
+    assert subscription.subscriber.group is group
+
+
+def test_binary_frames_get_an_error_reply(monkeypatch):
+    monkeypatch.setattr(relay, "language_dict", LANGUAGES)
+    with TestClient(relay.app).websocket_connect("/api/subscribe") as websocket:
+        websocket.send_bytes(b'{"action": "subscribe", "types": ["wikipedia"]}')
+        assert websocket.receive_json() == {'error': "messages must be JSON objects"}
+        # and the connection is still usable
+        websocket.send_json({'action': 'subscribe', 'types': ['wikipedia']})
+        assert websocket.receive_json() == {
+            'subscribed': {'codes': [], 'types': ['wikipedia'], 'languages': [], 'hashtags': []}}
+    assert not relay.subscription_registry
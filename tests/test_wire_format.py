@@ -0,0 +1,37 @@
+"""
+Tests for the compact wire format tables.
+"""
+from l2wc_api import main as relay
+
+
+def make_event(code: str, wiki_type, language: str, event_type: str = 'edit') -> relay.RefinedEvent:
+    return relay.RefinedEvent(1, "example.org", wiki_type, event_type, code, language, "Title", "url", 0, "user",
+                              False, 10)
+
+
+def test_ids_do_not_depend_on_listing_order():
+    tables, other_tables = relay.WireFormatTables(), relay.WireFormatTables()
+    tables.extend(["en_wikipedia", "commons", "de_wiktionary"], ["wikipedia", "special"], ["English", "German"])
+    other_tables.extend(["de_wiktionary", "commons", "en_wikipedia"], ["special", "wikipedia"], ["German", "English"])
+    assert tables.describe() == other_tables.describe()
+
+
+def test_extend_keeps_existing_ids():
+    tables = relay.WireFormatTables()
+    tables.extend(["en_wikipedia"], ["wikipedia"], ["English"])
+    en_id, version = tables.codes["en_wikipedia"], tables.version
+    tables.extend(["aa_wikipedia", "en_wikipedia"], ["wikipedia"], ["English"])
+    assert tables.codes["en_wikipedia"] == en_id
+    assert tables.version == version + 1
+
+
+def test_values_missing_from_the_tables_are_sent_as_strings():
+    tables = relay.WireFormatTables()
+    tables.extend(["en_wikipedia"], ["wikipedia"], ["English"])
+    compact = tables.compact(make_event("en_wikipedia", "wikipedia", "English", "new_page"))
+    assert compact[1:5] == [tables.codes["en_wikipedia"], tables.types["wikipedia"], tables.languages["English"],
+                            relay.WireFormatTables.EVENT_TYPES.index("new_page")]
+    compact = tables.compact(make_event("xx_wikipedia", None, "Klingon"))
+    assert compact[1:4] == ["xx_wikipedia", None, "Klingon"]
+    # and no ids were assigned for them
+    assert "xx_wikipedia" not in tables.codes
@@ -1,14 +1,202 @@
 /**
  * @fileoverview A worker to handle connection to the Python-powered API backend to fetch events
- * Listens to Server-Sent Events from the backend and updates the UI in real-time.
+ * Keeps one WebSocket subscription open to the backend and changes its filters over it, falling back to
+ * Server-Sent Events where WebSockets don't get through, and updates the UI in real-time.
  * @param e the event from the front end instructing the relay on what events to send to us.
  */
 
 let eventSource;
 let port;
+let lastEventId; // so a new event source can pick up where the old one left off
+const BATCH_MS = 100; // whole wiki types can be busy, so have the relay send their events in batches
+let wireFormat; // tables for decoding compact events, from /api/wire_format
+let wireFormatRequest;
+let connection = 0; // counts filter changes, so a stale pending connection isn't opened
+let socket; // the persistent subscription, preferred over an event source
+let socketUsable = typeof WebSocket !== "undefined";
+let socketFilters = {codes: [], types: [], languages: []}; // the filters the relay has for our socket
+let socketBatchMs = 0;
+let wantedFilters = {codes: [], types: [], languages: []}; // the filters the UI asked for last
+const SOCKET_RECONNECT_MS = 3000;
+
+/**
+ * Fetch the tables for decoding compact events. Ids are never reassigned, so they only need fetching again
+ * when an event has an id we don't know yet.
+ */
+function loadWireFormat(apiUrl) {
+    if (!wireFormatRequest) {
+        wireFormatRequest = fetch(new URL('/api/wire_format', apiUrl))
+            .then((response) => response.json())
+            .then((tables) => {
+                wireFormat = tables;
+            })
+            .catch((err) => {
+                console.error('Unable to load wire format tables', err);
+            })
+            .finally(() => {
+                wireFormatRequest = null;
+            });
+    }
+    return wireFormatRequest;
+}
+
+/**
+ * Look up a value sent as an id in one of the wire format tables. Values that aren't in the tables are sent as
+ * they are.
+ */
+function fromTable(table, value) {
+    return typeof value === 'number' ? table[value] : value;
+}
+
+/**
+ * Turn a compact event array back into the refined event object the UI expects.
+ */
+function decodeCompactEvent(values, apiUrl) {
+    const data = {};
+    wireFormat.fields.forEach((field, i) => {
+        data[field] = values[i];
+    });
+    const code = fromTable(wireFormat.codes, data.code);
+    const wikiType = fromTable(wireFormat.types, data.wiki_type);
+    const language = fromTable(wireFormat.languages, data.language);
+    const eventType = fromTable(wireFormat.eventTypes, data.event_type);
+    if (code === undefined || wikiType === undefined || language === undefined || eventType === undefined) {
+        loadWireFormat(apiUrl);
+    }
+    data.code = code ?? '';
+    data.wiki_type = wikiType ?? '';
+    data.language = language ?? '';
+    data.event_type = eventType ?? 'unknown';
+    return data;
+}
 
 function handleMessage(e) {
     const ed = e.data;
+
+    // new message from front end UI
+    let apiUrl = ed.apiUrl
+    wantedFilters = {
+        codes: ed.wikiCodes || [],
+        types: ed.wikiTypes || [],
+        languages: ed.wikiLangs || [],
+    };
+    console.log("Got " + wantedFilters.codes.length + " wikiCodes")
+
+    // compact events are a fraction of the size, if we can decode them
+    const thisConnection = ++connection;
+    (wireFormat ? Promise.resolve() : loadWireFormat(apiUrl)).then(() => {
+        if (thisConnection !== connection) {
+            return;
+        }
+        if (socketUsable) {
+            updateSocket(apiUrl);
+        } else {
+            updateEventSource(apiUrl);
+        }
+    });
+}
+
+function hasFilters(filters) {
+    return filters.codes.length > 0 || filters.types.length > 0 || filters.languages.length > 0;
+}
+
+function batchMsFor(filters) {
+    return filters.types.length > 0 ? BATCH_MS : 0;
+}
+
+function decoderFor(compact, apiUrl) {
+    return compact ? (values) => decodeCompactEvent(values, apiUrl) : (data) => data;
+}
+
+/**
+ * Bring the socket subscription in line with the wanted filters, by sending the relay only what changed.
+ */
+function updateSocket(apiUrl) {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        const added = {}, removed = {};
+        let anyAdded = false, anyRemoved = false;
+        for (const field of ['codes', 'types', 'languages']) {
+            added[field] = wantedFilters[field].filter((value) => !socketFilters[field].includes(value));
+            removed[field] = socketFilters[field].filter((value) => !wantedFilters[field].includes(value));
+            anyAdded = anyAdded || added[field].length > 0;
+            anyRemoved = anyRemoved || removed[field].length > 0;
+        }
+        const batchMs = batchMsFor(wantedFilters);
+        if (anyAdded || batchMs !== socketBatchMs) {
+            socket.send(JSON.stringify({action: 'subscribe', ...added, batch_ms: batchMs}));
+        }
+        if (anyRemoved) {
+            socket.send(JSON.stringify({action: 'unsubscribe', ...removed}));
+        }
+        socketFilters = wantedFilters;
+        socketBatchMs = batchMs;
+    } else if (!socket) {
+        if (hasFilters(wantedFilters)) {
+            openSocket(apiUrl);
+        } else {
+            console.info('Not opening event socket because no wiki codes, types, or languages were selected')
+        }
+    }
+    // otherwise the socket is still connecting, and sends the wanted filters once it is open
+}
+
+function openSocket(apiUrl) {
+    const compact = Boolean(wireFormat);
+    const decode = decoderFor(compact, apiUrl);
+    const socketUrl = new URL('/api/subscribe', apiUrl);
+    socketUrl.protocol = socketUrl.protocol === 'https:' ? 'wss:' : 'ws:';
+    if (compact) {
+        socketUrl.searchParams.set('format', 'compact');
+    }
+    console.info('Creating event socket with URL: ' + socketUrl);
+    let opened = false;
+    socket = new WebSocket(socketUrl);
+
+    socket.onopen = () => {
+        console.info('Event socket opened to URL: ' + socketUrl);
+        opened = true;
+        socketFilters = wantedFilters;
+        socketBatchMs = batchMsFor(wantedFilters);
+        socket.send(JSON.stringify({action: 'set', ...socketFilters, batch_ms: socketBatchMs, last_event_id: lastEventId}));
+    };
+    socket.onmessage = (event) => {
+        // event.data will be a JSON message holding an array of events, unpacked here so the UI sees them one at a time
+        try {
+            const message = JSON.parse(event.data);
+            if (message.events) {
+                lastEventId = message.id;
+                for (const data of message.events) {
+                    port.postMessage(decode(data));
+                }
+            } else if (message.error) {
+                console.error('Error from event socket: ' + message.error);
+            }
+        } catch (err) {
+            console.error(err)
+        }
+    };
+    socket.onclose = (event) => {
+        socket = null;
+        if (!opened) {
+            // probably a proxy that doesn't pass WebSockets through
+            console.warn('Unable to open event socket, falling back to an event stream');
+            socketUsable = false;
+            updateEventSource(apiUrl);
+            return;
+        }
+        console.warn('Event socket closed, reconnecting. Code: ' + event.code);
+        setTimeout(() => {
+            if (!socket) {
+                updateSocket(apiUrl);
+            }
+        }, SOCKET_RECONNECT_MS);
+    };
+}
+
+/**
+ * Open a new event source for the wanted filters, replacing the old one.
+ */
+function updateEventSource(apiUrl) {
     // if there was already an event source connected, disconnect it first
     if (eventSource && eventSource.readyState in [0, 1]) {
         console.info("Closing old event source connection")
@@ -16,56 +204,76 @@ function handleMessage(e) {
     }
     eventSource = null;
 
-    // new message from front end UI
-    let apiUrl = ed.apiUrl
-    let wikiCodes = ed.wikiCodes;
-    let wikiTypes = ed.wikiTypes;
-    let wikiLangs = ed.wikiLangs;
-    console.log("Got " + wikiCodes.length + " wikiCodes")
     let eventAPIUrl = new URL(apiUrl);
     let setAtLeastOneParam = false
-    if (wikiCodes && wikiCodes.length > 0) {
-        eventAPIUrl.searchParams.set('codes', wikiCodes.toString());
+    if (wantedFilters.codes.length > 0) {
+        eventAPIUrl.searchParams.set('codes', wantedFilters.codes.toString());
         setAtLeastOneParam = true;
     }
-    if (wikiTypes && wikiTypes.length > 0) {
-        eventAPIUrl.searchParams.set('types', wikiTypes.toString());
+    if (wantedFilters.types.length > 0) {
+        eventAPIUrl.searchParams.set('types', wantedFilters.types.toString());
+        eventAPIUrl.searchParams.set('batch_ms', BATCH_MS);
         setAtLeastOneParam = true;
     }
-    if (wikiLangs && wikiLangs.length > 0) {
-        eventAPIUrl.searchParams.set('languages', wikiLangs.toString());
+    if (wantedFilters.languages.length > 0) {
+        eventAPIUrl.searchParams.set('languages', wantedFilters.languages.toString());
         setAtLeastOneParam = true;
     }
 
     if (setAtLeastOneParam) {
-        console.info('Creating event stream with URL: ' + eventAPIUrl);
-        eventSource = new EventSource(eventAPIUrl);
-
-        eventSource.onopen = () => {
-            console.info('Event stream started from URL: ' + eventAPIUrl);
-        };
-        eventSource.onerror = (event) => {
-            console.error('Error from event stream. Event: ', JSON.stringify(event));
-        };
-        eventSource.onclose = (event) => {
-            console.warn('Event stream closed. Event: ', JSON.stringify(event));
-        }
-        eventSource.addEventListener("wiki_event", (event) => {
-            // event.data will be a JSON message
-            // console.log("Event received")
-            try {
-                const data = JSON.parse(event.data);
-                // console.log('Received event from server: ' + JSON.stringify(data))
-                port.postMessage(data);
-            } catch (err) {
-                console.error(err)
-            }
-        });
+        openEventSource(apiUrl, eventAPIUrl);
     } else {
         console.info('Not opening event stream because no wiki codes, types, or languages were selected')
     }
 }
 
+function openEventSource(apiUrl, eventAPIUrl) {
+    const compact = Boolean(wireFormat);
+    if (compact) {
+        eventAPIUrl.searchParams.set('format', 'compact');
+    }
+    if (lastEventId) {
+        eventAPIUrl.searchParams.set('last_event_id', lastEventId);
+    }
+    const decode = decoderFor(compact, apiUrl);
+    console.info('Creating event stream with URL: ' + eventAPIUrl);
+    eventSource = new EventSource(eventAPIUrl);
+
+    eventSource.onopen = () => {
+        console.info('Event stream started from URL: ' + eventAPIUrl);
+    };
+    eventSource.onerror = (event) => {
+        console.error('Error from event stream. Event: ', JSON.stringify(event));
+    };
+    eventSource.onclose = (event) => {
+        console.warn('Event stream closed. Event: ', JSON.stringify(event));
+    }
+    eventSource.addEventListener("wiki_event", (event) => {
+        // event.data will be a JSON message
+        // console.log("Event received")
+        lastEventId = event.lastEventId;
+        try {
+            const data = decode(JSON.parse(event.data));
+            // console.log('Received event from server: ' + JSON.stringify(data))
+            port.postMessage(data);
+        } catch (err) {
+            console.error(err)
+        }
+    });
+    eventSource.addEventListener("wiki_events", (event) => {
+        // event.data will be a JSON array of messages, unpacked here so the UI sees them one at a time
+        lastEventId = event.lastEventId;
+        try {
+            const batch = JSON.parse(event.data);
+            for (const data of batch) {
+                port.postMessage(decode(data));
+            }
+        } catch (err) {
+            console.error(err)
+        }
+    });
+}
+
 let isSharedWorker = typeof self.onconnect !== "undefined";
 
 if (isSharedWorker) {